@@ -0,0 +1,386 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+
+class Cassette:
+    """
+    请求录制/回放磁带，把 HTTP 请求与响应（含流式分块的时间线）保存到 JSONL 文件
+
+    响应体按传输层收到的原始字节（可能经过 gzip/br 压缩）以 base64 保存，并一同保存 content-encoding，
+    回放时由 httpx 按同样的方式解码，与真实响应一致
+
+    - record：真实请求照常发出，响应原样透传给调用方，同时写入磁带
+    - replay：不访问网络，按请求内容从磁带中取出响应；latency_scale 控制按录制时的耗时回放
+      （1.0 为原速，0 为立即返回）；磁带中找不到的请求返回 404 错误
+    以 httpx transport 的形式接入，因此 LLMClient 以及 AgentScope / AutoGen / LangGraph 等
+    基于 OpenAI SDK 的模型封装都可以通过传入 http_client 使用同一份磁带。
+    """
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, path: str, mode: str = REPLAY, latency_scale: float = 0.0):
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f"未知的磁带模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        # 同一请求出现多次时按录制顺序依次回放，用完后重复最后一条
+        self._cursors: Dict[str, int] = {}
+        if mode == self.REPLAY:
+            self._load()
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        """
+        从环境变量创建磁带，未配置 LLM_CASSETTE 时返回 None
+
+        LLM_CASSETTE: 磁带文件路径
+        LLM_CASSETTE_MODE: record | replay，默认 replay
+        LLM_CASSETTE_LATENCY: 回放耗时倍率，默认 0
+        """
+        path = os.getenv("LLM_CASSETTE")
+        if not path:
+            return None
+        return cls(
+            path=path,
+            mode=os.getenv("LLM_CASSETTE_MODE", cls.REPLAY),
+            latency_scale=float(os.getenv("LLM_CASSETTE_LATENCY", "0"))
+        )
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"磁带文件不存在: {self.path}")
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    @staticmethod
+    def make_key(method: str, url: str, body: bytes) -> str:
+        """
+        请求的稳定键：方法 + 路径 + 规范化后的请求体，不包含服务地址，换端点后录制结果仍可复用
+        """
+        try:
+            canonical = json.dumps(json.loads(body), ensure_ascii=False, sort_keys=True)
+        except ValueError:
+            canonical = body.decode("utf-8", errors="replace")
+        payload = f"{method.upper()} {urlsplit(url).path}\n{canonical}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries.setdefault(entry["key"], []).append(entry)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            self.hits += 1
+            return entries[min(cursor, len(entries) - 1)]
+
+    def _miss_response(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            404,
+            json={"error": {"message": f"磁带 {self.path} 中没有录制该请求: {request.method} {request.url.path}",
+                            "type": "cassette_miss"}},
+            request=request
+        )
+
+    def _replay_response(self, request: httpx.Request, entry: Dict[str, Any], stream) -> httpx.Response:
+        return httpx.Response(
+            entry["status"],
+            headers=entry["headers"],
+            stream=stream,
+            request=request
+        )
+
+    def _new_entry(self, request: httpx.Request, response: httpx.Response, started: float) -> Dict[str, Any]:
+        body = request.content
+        return {
+            "key": self.make_key(request.method, str(request.url), body),
+            "method": request.method,
+            "path": request.url.path,
+            "request": body.decode("utf-8", errors="replace"),
+            "status": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() in _RECORDED_HEADERS},
+            "ttfb": time.perf_counter() - started,
+            "timeline": [],
+            "body_b64": "",
+        }
+
+    def transport(self, inner: httpx.BaseTransport = None) -> httpx.BaseTransport:
+        """
+        供 httpx.Client(transport=...) 使用
+        """
+        return _CassetteTransport(self, inner or httpx.HTTPTransport())
+
+    def async_transport(self, inner: httpx.AsyncBaseTransport = None) -> httpx.AsyncBaseTransport:
+        """
+        供 httpx.AsyncClient(transport=...) 使用
+        """
+        return _AsyncCassetteTransport(self, inner or httpx.AsyncHTTPTransport())
+
+    def wrap_tool(self, name: str, func: Callable) -> Callable:
+        """
+        录制/回放普通函数（如天气、搜索工具）的返回值，按函数名与参数区分，返回值需可 JSON 序列化
+        """
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            body = json.dumps({"args": args, "kwargs": kwargs}, ensure_ascii=False, sort_keys=True).encode("utf-8")
+            key = self.make_key("CALL", f"/tool/{name}", body)
+            if self.mode == self.REPLAY:
+                entry = self._lookup(key)
+                if entry is None:
+                    raise KeyError(f"磁带 {self.path} 中没有录制工具调用: {name}{args or ''}{kwargs or ''}")
+                return json.loads(entry["body"])
+            result = func(*args, **kwargs)
+            self._append({"key": key, "method": "CALL", "path": f"/tool/{name}", "request": body.decode("utf-8"),
+                          "body": json.dumps(result, ensure_ascii=False)})
+            return result
+        return _wrapper
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# 回放时需要保留的响应头：content-encoding 决定 httpx 如何解码保存的原始字节
+_RECORDED_HEADERS = ("content-type", "content-encoding")
+
+
+def _entry_body(entry: Dict[str, Any]) -> bytes:
+    if "body_b64" in entry:
+        return base64.b64decode(entry["body_b64"])
+    # 旧版磁带以 UTF-8 文本保存未压缩的响应体
+    return entry["body"].encode("utf-8")
+
+
+def _split_timeline(entry: Dict[str, Any]) -> List[Tuple[float, bytes]]:
+    """
+    把录制的响应体按时间线还原为 (距请求开始的秒数, 数据块) 列表
+    """
+    body = _entry_body(entry)
+    timeline = entry.get("timeline") or [[entry.get("ttfb", 0.0), len(body)]]
+    pieces = []
+    offset = 0
+    for at, size in timeline:
+        pieces.append((at, body[offset:offset + size]))
+        offset += size
+    if offset < len(body):
+        pieces.append((timeline[-1][0], body[offset:]))
+    return pieces
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, entry: Dict[str, Any], latency_scale: float):
+        self.pieces = _split_timeline(entry)
+        self.latency_scale = latency_scale
+
+    def __iter__(self) -> Iterator[bytes]:
+        started = time.perf_counter()
+        for at, piece in self.pieces:
+            delay = at * self.latency_scale - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            yield piece
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, entry: Dict[str, Any], latency_scale: float):
+        self.pieces = _split_timeline(entry)
+        self.latency_scale = latency_scale
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        started = time.perf_counter()
+        for at, piece in self.pieces:
+            delay = at * self.latency_scale - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield piece
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """
+    透传真实响应的数据块，同时记录每块到达的时间，响应关闭时写入磁带
+    """
+    def __init__(self, cassette: Cassette, entry: Dict[str, Any], inner: httpx.SyncByteStream, started: float):
+        self.cassette = cassette
+        self.entry = entry
+        self.inner = inner
+        self.started = started
+        self.body = bytearray()
+
+    def __iter__(self) -> Iterator[bytes]:
+        for piece in self.inner:
+            self.body.extend(piece)
+            self.entry["timeline"].append([time.perf_counter() - self.started, len(piece)])
+            yield piece
+
+    def close(self) -> None:
+        self.inner.close()
+        self.entry["body_b64"] = base64.b64encode(bytes(self.body)).decode("ascii")
+        self.cassette._append(self.entry)
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, cassette: Cassette, entry: Dict[str, Any], inner: httpx.AsyncByteStream, started: float):
+        self.cassette = cassette
+        self.entry = entry
+        self.inner = inner
+        self.started = started
+        self.body = bytearray()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for piece in self.inner:
+            self.body.extend(piece)
+            self.entry["timeline"].append([time.perf_counter() - self.started, len(piece)])
+            yield piece
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+        self.entry["body_b64"] = base64.b64encode(bytes(self.body)).decode("ascii")
+        self.cassette._append(self.entry)
+
+
+class _CassetteTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette, inner: httpx.BaseTransport):
+        self.cassette = cassette
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        if self.cassette.mode == Cassette.REPLAY:
+            entry = self.cassette._lookup(Cassette.make_key(request.method, str(request.url), request.content))
+            if entry is None:
+                return self.cassette._miss_response(request)
+            return self.cassette._replay_response(
+                request, entry, _ReplayStream(entry, self.cassette.latency_scale)
+            )
+
+        started = time.perf_counter()
+        response = self.inner.handle_request(request)
+        entry = self.cassette._new_entry(request, response, started)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(self.cassette, entry, response.stream, started),
+            extensions=response.extensions,
+            request=request
+        )
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class _AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, inner: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        if self.cassette.mode == Cassette.REPLAY:
+            entry = self.cassette._lookup(Cassette.make_key(request.method, str(request.url), request.content))
+            if entry is None:
+                return self.cassette._miss_response(request)
+            return self.cassette._replay_response(
+                request, entry, _AsyncReplayStream(entry, self.cassette.latency_scale)
+            )
+
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        entry = self.cassette._new_entry(request, response, started)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_AsyncRecordingStream(self.cassette, entry, response.stream, started),
+            extensions=response.extensions,
+            request=request
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+_shared_cassette: Optional[Cassette] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_cassette() -> Optional[Cassette]:
+    """
+    获取进程内共享的磁带；首次调用时按 LLM_CASSETTE 等环境变量创建，未配置时返回 None
+    """
+    global _shared_cassette
+    with _shared_lock:
+        if _shared_cassette is None:
+            _shared_cassette = Cassette.from_env()
+        return _shared_cassette
+
+
+def check_round_trip(path: str) -> None:
+    """
+    自检：录制一个 gzip 压缩的流式响应，再从磁带回放，确认解码后的内容一致
+    """
+    import gzip
+
+    payload = json.dumps({"choices": [{"message": {"content": "你好 pong"}}]}, ensure_ascii=False).encode("utf-8")
+    compressed = gzip.compress(payload)
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "application/json", "content-encoding": "gzip"},
+                              stream=httpx.ByteStream(compressed))
+
+    if os.path.exists(path):
+        os.remove(path)
+    request_body = {"model": "m", "messages": [{"role": "user", "content": "ping"}]}
+    with httpx.Client(transport=Cassette(path, mode=Cassette.RECORD).transport(httpx.MockTransport(_handler))) as client:
+        recorded = client.post("http://recorded.example/v1/chat/completions", json=request_body).json()
+    with httpx.Client(transport=Cassette(path, mode=Cassette.REPLAY).transport()) as client:
+        replayed = client.post("http://other.example/v1/chat/completions", json=request_body).json()
+    assert recorded == replayed == json.loads(payload), (recorded, replayed)
+    print(f"✅ gzip 响应录制/回放一致: {replayed['choices'][0]['message']['content']}")
+
+
+if __name__ == "__main__":
+    # 先用 LLM_CASSETTE_MODE=record 跑一遍真实调用，之后即可离线回放；--check 运行压缩响应的录制/回放自检
+    import sys
+    import tempfile
+
+    if "--check" in sys.argv:
+        check_round_trip(os.path.join(tempfile.gettempdir(), "cassette_check.jsonl"))
+        sys.exit(0)
+
+    from LLMClient import LLMClient
+
+    cassette = get_shared_cassette()
+    if cassette is None:
+        print("请设置 LLM_CASSETTE=<磁带文件> 与 LLM_CASSETTE_MODE=record|replay")
+        sys.exit(1)
+
+    client = LLMClient(model="deepseek-chat", cassette=cassette,
+                       apiKey=os.getenv("OPENAI_API_KEY", "replay"),
+                       baseUrl=os.getenv("OPENAI_API_BASE_URL", "https://api.deepseek.com"))
+    start = time.perf_counter()
+    client.generate([{"role": "user", "content": "用一句话介绍快速排序"}], stream=True)
+    print(f"耗时 {time.perf_counter() - start:.2f}s，磁带统计 {cassette.stats()}")
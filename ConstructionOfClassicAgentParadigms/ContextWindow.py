@@ -0,0 +1,211 @@
+import hashlib
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from Metrics import MetricsRegistry, default_registry
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+SUMMARY_PROMPT_TEMPLATE = """
+    请把下面的对话或执行记录压缩成一段简洁的摘要，保留关键事实、已得到的结果和尚未解决的问题，
+    不要添加任何额外的解释，摘要不超过 {max_tokens} 个 token。
+
+    {content}
+    """
+
+SUMMARY_PREFIX = "【较早内容的摘要】\n"
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+class TokenCounter:
+    """
+    本地 token 计数器：安装了 tiktoken 时使用其编码，否则按中文每字 1 个、其他每 4 个字符 1 个估算
+
+    相同文本的计数结果会被缓存，逐轮增长的历史只需计算新增的部分
+    """
+    def __init__(self, encoding: str = "cl100k_base", cache_size: int = 4096):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding)
+            except Exception:
+                # 编码文件需要联网下载，离线环境下退回估算
+                self._encoding = None
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        cjk = len(_CJK_RE.findall(text))
+        return cjk + math.ceil((len(text) - cjk) / 4)
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        对话消息的 token 数，每条消息额外计入 4 个格式 token
+        """
+        return sum(self.count(str(m.get("content") or "")) + 4 for m in messages) + 2
+
+
+class ContextWindow:
+    """
+    上下文窗口管理：按 token 预算裁剪对话消息或历史片段
+
+    策略：
+    - drop_oldest：从最早的消息开始丢弃，直到满足预算
+    - keep_last：只保留最近 keep_last 条消息（仍超预算时继续丢弃最早的）
+    - summarize：把 keep_last 条之前的消息交给 summarizer（通常是更便宜的模型）压缩成摘要；
+      摘要按前缀增量更新，历史逐轮增长时只需对新增部分再做一次压缩
+    system 消息与开头的 keep_first 条消息（如用户的原始任务）始终保留，最后一条消息也不会被丢弃。
+    group_turns=True 时，每条 assistant 消息与紧随其后的非 assistant 消息（如 Observation、工具结果）
+    作为一个整体保留或丢弃，不会留下缺少对应 Action 的 Observation。
+    """
+    DROP_OLDEST = "drop_oldest"
+    KEEP_LAST = "keep_last"
+    SUMMARIZE = "summarize"
+
+    def __init__(self,
+                 max_tokens: int = 8000,
+                 strategy: str = DROP_OLDEST,
+                 keep_last: int = 6,
+                 keep_first: int = 0,
+                 group_turns: bool = False,
+                 summarizer=None,
+                 summary_tokens: int = 300,
+                 counter: TokenCounter = None,
+                 metrics: MetricsRegistry = None):
+        if strategy not in (self.DROP_OLDEST, self.KEEP_LAST, self.SUMMARIZE):
+            raise ValueError(f"未知的裁剪策略: {strategy}")
+        if strategy == self.SUMMARIZE and summarizer is None:
+            raise ValueError("summarize 策略需要提供 summarizer（LLMClient）")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.keep_last = keep_last
+        self.keep_first = keep_first
+        self.group_turns = group_turns
+        self.summarizer = summarizer
+        self.summary_tokens = summary_tokens
+        self.counter = counter or TokenCounter()
+        self.metrics = metrics or default_registry
+
+        # 最近一次摘要：(被摘要的消息条数, 这些消息的哈希, 摘要文本)
+        self._last_summary: Optional[tuple] = None
+
+    def fit(self, messages: List[Dict[str, Any]], label: str = None) -> List[Dict[str, Any]]:
+        """
+        返回满足预算的消息列表；未超预算时原样返回传入的列表
+        """
+        total = self.counter.count_messages(messages)
+        self.metrics.observe("llm_context_tokens", total, agent=label, stage="before")
+        if total <= self.max_tokens:
+            return messages
+
+        system = [m for m in messages if m.get("role") == "system"]
+        rest = [m for m in messages if m.get("role") != "system"]
+        head, body = rest[:self.keep_first], rest[self.keep_first:]
+
+        summary = []
+        if self.strategy == self.KEEP_LAST:
+            body = body[self._align(body, len(body) - max(self.keep_last, 1)):]
+        elif self.strategy == self.SUMMARIZE and len(body) > max(self.keep_last, 1):
+            split = self._align(body, len(body) - max(self.keep_last, 1))
+            older, body = body[:split], body[split:]
+            if older:
+                text = self._summarize(older, label)
+                if text:
+                    summary = [{"role": "user", "content": SUMMARY_PREFIX + text}]
+
+        # 仍超预算时继续丢弃最早的消息（或整轮），至少保留最后一条（或最后一轮）
+        fixed = self.counter.count_messages(system + head + summary)
+        budget = self.max_tokens - fixed
+        kept = []
+        for group in reversed(self._groups(body)):
+            cost = sum(self.counter.count(str(m.get("content") or "")) + 4 for m in group)
+            if kept and cost > budget:
+                break
+            kept = group + kept
+            budget -= cost
+
+        fitted = system + head + summary + kept
+        self.metrics.inc("llm_context_trimmed_total", agent=label, strategy=self.strategy)
+        self.metrics.observe("llm_context_tokens", self.counter.count_messages(fitted), agent=label, stage="after")
+        return fitted
+
+    def _groups(self, messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        按裁剪单位分组：默认每条消息一组，group_turns 时每条 assistant 消息连同其后的非 assistant 消息为一组
+        """
+        groups = []
+        for message in messages:
+            if self.group_turns and groups and message.get("role") != "assistant" \
+                    and groups[-1][0].get("role") == "assistant":
+                groups[-1].append(message)
+            else:
+                groups.append([message])
+        return groups
+
+    def _align(self, messages: List[Dict[str, Any]], split: int) -> int:
+        """
+        group_turns 时把切分位置前移到所在轮次的开头，避免把一轮拆开
+        """
+        split = max(split, 0)
+        if self.group_turns:
+            while 0 < split < len(messages) and messages[split].get("role") != "assistant" \
+                    and any(m.get("role") == "assistant" for m in messages[:split]):
+                split -= 1
+        return split
+
+    def fit_texts(self, parts: List[str], label: str = None) -> List[str]:
+        """
+        对字符串形式的历史片段（如执行历史、反思轨迹）做同样的裁剪
+        """
+        fitted = self.fit([{"role": "user", "content": part} for part in parts], label=label)
+        return [m["content"] for m in fitted]
+
+    def _summarize(self, messages: List[Dict[str, Any]], label: Optional[str]) -> Optional[str]:
+        contents = [str(m.get("content") or "") for m in messages]
+        previous = self._last_summary
+        if previous is not None and previous[0] <= len(contents) and previous[1] == self._hash(contents[:previous[0]]):
+            if previous[0] == len(contents):
+                return previous[2]
+            # 只把新增部分与上一次的摘要一起再压缩一次
+            contents = [SUMMARY_PREFIX + previous[2]] + contents[previous[0]:]
+
+        prompt = SUMMARY_PROMPT_TEMPLATE.format(max_tokens=self.summary_tokens, content="\n\n".join(contents))
+        summary = self.summarizer.generate(
+            [{"role": "user", "content": prompt}], quiet=True, label=f"{label or 'Agent'}.ContextSummarizer"
+        )
+        if summary:
+            self._last_summary = (len(messages), self._hash([str(m.get("content") or "") for m in messages]), summary)
+        return summary
+
+    @staticmethod
+    def _hash(contents: List[str]) -> str:
+        digest = hashlib.sha256()
+        for content in contents:
+            digest.update(content.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+
+if __name__ == "__main__":
+    counter = TokenCounter()
+    print(f"tiktoken: {'可用' if counter._encoding is not None else '不可用，使用估算'}")
+
+    history = [{"role": "system", "content": "你是一个旅行助手"},
+               {"role": "user", "content": "帮我查询今天广州的天气，并推荐景点"}]
+    for i in range(30):
+        history.append({"role": "assistant", "content": f"Thought: 第 {i} 步思考……\nAction: get_weather(city='广州')"})
+        history.append({"role": "user", "content": f"Observation: 广州当前天气：晴，气温 {20 + i % 5} 摄氏度" * 5})
+
+    window = ContextWindow(max_tokens=600, strategy=ContextWindow.DROP_OLDEST, keep_first=1)
+    fitted = window.fit(history, label="demo")
+    print(f"裁剪前 {counter.count_messages(history)} tokens / {len(history)} 条，"
+          f"裁剪后 {counter.count_messages(fitted)} tokens / {len(fitted)} 条")
+    print(window.metrics.to_json())
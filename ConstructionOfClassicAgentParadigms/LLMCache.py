@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class LLMResponseCache:
+    """
+    基于 SQLite 的 LLM 响应缓存，按请求内容的稳定哈希持久化到磁盘
+
+    - 容量超过 max_entries 时按最近访问时间做 LRU 淘汰
+    - ttl 为缓存有效期（秒），None 表示永不过期
+    - bypass 为 True 时跳过读取但仍写入，用于强制刷新缓存
+    """
+    def __init__(self,
+                 path: str = "llm_cache.sqlite3",
+                 max_entries: int = 10000,
+                 ttl: Optional[float] = None,
+                 bypass: bool = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bypass = bypass if bypass is not None else os.getenv("LLM_CACHE_BYPASS") == "1"
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+        """
+        根据 (model, messages, temperature) 生成稳定的缓存键
+        """
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature},
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存，未命中、已过期或处于 bypass 模式时返回 None
+        """
+        if self.bypass:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return response
+
+    def set(self, key: str, response: str) -> None:
+        """
+        写入缓存，超出容量时淘汰最久未访问的记录
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            overflow = self._size() - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """
+        清空缓存及统计
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+        """
+        with self._lock:
+            size = self._size()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+if __name__ == "__main__":
+    cache = LLMResponseCache(path=":memory:", max_entries=2, ttl=60)
+    messages = [{"role": "user", "content": "写一个快速排序算法"}]
+    key = LLMResponseCache.make_key("deepseek-chat", messages, 0)
+
+    print(cache.get(key))
+    cache.set(key, "def quick_sort(arr): ...")
+    print(cache.get(key))
+    print(cache.stats())
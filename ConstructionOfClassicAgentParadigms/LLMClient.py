@@ -1,63 +1,753 @@
+import asyncio
+import itertools
 import os
-from typing import Dict, List
-from openai import OpenAI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from Cassette import Cassette, get_shared_cassette
+from ContextWindow import ContextWindow
+from LLMCache import LLMResponseCache
+from Metrics import MetricsRegistry, default_registry
+from RateLimiter import RateLimiter, estimate_tokens, get_shared_limiter
+from Router import Endpoint, EndpointRouter
+from SingleFlight import SingleFlight
+from Resilience import (CircuitBreaker, HedgePolicy, RetryPolicy, acall_with_retry, ahedged_call,
+                        call_with_retry, hedged_call)
+from StreamSink import BufferedStdoutSink, NullSink, StreamSink
+
+
+def _silent(*args, **kwargs) -> None:
+    pass
 
 
 class LLMClient:
     """
     LLM客户端, 基于 OpenAI API 封装
     """
-    def __init__(self, model: str, apiKey: str = None, baseUrl: str = None, timeout: int = None):
+    def __init__(self,
+                 model: str,
+                 apiKey: str = None,
+                 baseUrl: str = None,
+                 timeout: int = None,
+                 max_connections: int = 20,
+                 cache: LLMResponseCache = None,
+                 quiet: bool = False,
+                 metrics: MetricsRegistry = None,
+                 label: str = None,
+                 stream_usage: bool = True,
+                 retry: RetryPolicy = None,
+                 hedge: HedgePolicy = None,
+                 circuit_breaker: CircuitBreaker = None,
+                 raise_on_error: bool = False,
+                 router: EndpointRouter = None,
+                 rate_limiter: RateLimiter = None,
+                 single_flight: SingleFlight = None,
+                 cassette: Cassette = None,
+                 context_window: ContextWindow = None):
         if not model:
             raise ValueError("model is required")
         self.model = model
         self.apiKey = apiKey or os.getenv("OPENAI_API_KEY")
         self.baseUrl = baseUrl or os.getenv("OPENAI_API_BASE_URL")
         self.timeout = timeout or 30
+        self.max_connections = max_connections
+        # 可选的响应缓存，仅对 temperature=0 的确定性调用生效；也可通过 LLM_CACHE_PATH 环境变量开启
+        if cache is None and os.getenv("LLM_CACHE_PATH"):
+            cache = LLMResponseCache(path=os.getenv("LLM_CACHE_PATH"))
+        self.cache = cache
+        # 静默模式下 generate 不做任何控制台输出
+        self.quiet = quiet
+        # 指标上报：label 用于区分调用方（如 Planner / Executor），可在每次调用时覆盖
+        self.metrics = metrics or default_registry
+        self.label = label
+        # 流式调用时请求服务端在最后一个数据块中返回 token 用量
+        self.stream_usage = stream_usage
+        # 容错：客户端侧重试（替代 SDK 内置重试，便于统计）、可选的对冲请求与熔断器
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge
+        self.circuit_breaker = circuit_breaker
+        self._hedge_executor = ThreadPoolExecutor(max_workers=max_connections) if hedge else None
+        # 为 True 时 generate 失败直接抛出异常，而不是返回 None
+        self.raise_on_error = raise_on_error
+        # 客户端限流，默认使用进程内共享的限流器（由 LLM_RPM / LLM_TPM 配置，未配置则不限流）
+        self.rate_limiter = rate_limiter or get_shared_limiter()
+        # 可选的在途请求合并，仅对 temperature=0 的调用生效（采样调用本就期望得到不同结果）
+        self.single_flight = single_flight
+        # 可选的录制/回放磁带，用于离线、可复现的基准测试；默认使用由 LLM_CASSETTE 配置的共享磁带
+        self.cassette = cassette or get_shared_cassette()
+        # 可选的上下文窗口，调用前按 token 预算裁剪消息
+        self.context_window = context_window
 
-        if not all([self.model, self.apiKey, self.baseUrl]):
-            raise ValueError("模型、API密钥和服务地址必须被提供或在环境变量中定义。")
+        # 多端点路由：显式传入 router，或未指定 baseUrl 时读取 OPENAI_API_BASE_URLS；否则视为只有一个端点
+        self.router = router or (None if baseUrl else EndpointRouter.from_env())
+        if self.router is None:
+            if not all([self.model, self.apiKey, self.baseUrl]):
+                raise ValueError("模型、API密钥和服务地址必须被提供或在环境变量中定义。")
+            self.router = EndpointRouter([Endpoint(self.baseUrl, self.apiKey)])
 
-        self.client = OpenAI(
-            api_key=self.apiKey,
-            base_url=self.baseUrl,
-            timeout=self.timeout
+        self._clients: Dict[str, OpenAI] = {
+            endpoint.name: OpenAI(
+                api_key=endpoint.api_key,
+                base_url=endpoint.base_url,
+                timeout=self.timeout,
+                max_retries=0,
+                http_client=httpx.Client(
+                    limits=self._pool_limits(), timeout=self.timeout, transport=self._transport()
+                )
+            )
+            for endpoint in self.router.endpoints
+        }
+        # 兼容直接使用 client 的旧代码，指向第一个端点
+        self.client = self._clients[self.router.endpoints[0].name]
+        # 异步客户端的连接池与事件循环绑定，按需在当前事件循环中创建
+        self._async_clients: Dict[str, AsyncOpenAI] = {}
+        self._async_loop: asyncio.AbstractEventLoop = None
+
+    def _pool_limits(self) -> httpx.Limits:
+        """
+        连接池配置，所有请求复用同一组 keep-alive 连接
+        """
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections
         )
 
+    def _transport(self) -> Optional[httpx.BaseTransport]:
+        if self.cassette is None:
+            return None
+        return self.cassette.transport(httpx.HTTPTransport(limits=self._pool_limits()))
+
+    def _async_transport(self) -> Optional[httpx.AsyncBaseTransport]:
+        if self.cassette is None:
+            return None
+        return self.cassette.async_transport(httpx.AsyncHTTPTransport(limits=self._pool_limits()))
+
+    def _get_async_client(self, endpoint: Endpoint = None) -> AsyncOpenAI:
+        """
+        获取当前事件循环下指定端点（默认第一个端点）共享的异步客户端
+        """
+        endpoint = endpoint or self.router.endpoints[0]
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_clients = {}
+            self._async_loop = loop
+        if endpoint.name not in self._async_clients:
+            self._async_clients[endpoint.name] = AsyncOpenAI(
+                api_key=endpoint.api_key,
+                base_url=endpoint.base_url,
+                timeout=self.timeout,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=self._pool_limits(), timeout=self.timeout, transport=self._async_transport()
+                )
+            )
+        return self._async_clients[endpoint.name]
+
+    async def aclose(self) -> None:
+        """
+        关闭当前事件循环下的异步客户端，释放连接池
+        """
+        for client in self._async_clients.values():
+            await client.close()
+        self._async_clients = {}
+        self._async_loop = None
+
+    def check_endpoints(self) -> Dict[str, bool]:
+        """
+        探测所有端点是否可用，不可用的端点会被暂时摘除
+        """
+        return self.router.health_check(self._probe_endpoint)
+
+    def start_health_checks(self, interval: float = 30.0) -> None:
+        """
+        在后台定期探测所有端点
+        """
+        self.router.start_health_checks(self._probe_endpoint, interval=interval)
+
+    def _probe_endpoint(self, endpoint: Endpoint) -> None:
+        self._clients[endpoint.name].with_options(timeout=5).models.list()
+
+    def _routed(self,
+                fn: Callable[[OpenAI, str], Any],
+                labels: Dict[str, str],
+                tokens: int = 0) -> Callable[[], Any]:
+        """
+        包装单次请求：先向限流器申请配额，再由路由器选择端点，并把耗时与成败反馈给路由器
+
+        同一次调用中失败过的端点在后续重试里会被排除，从而自动切换到其他端点
+        """
+        tried: List[Endpoint] = []
+
+        def _call():
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(tokens, label=labels["agent"])
+            endpoint = self.router.select(exclude=tried)
+            started = time.perf_counter()
+            try:
+                result = fn(self._clients[endpoint.name], endpoint.model or self.model)
+            except BaseException as e:
+                if isinstance(e, Exception) and self.retry.is_retryable(e):
+                    self.router.record_failure(endpoint)
+                    tried.append(endpoint)
+                else:
+                    self.router.release(endpoint)
+                raise
+            self.router.record_success(endpoint, time.perf_counter() - started)
+            return result
+
+        return _call
+
+    def _arouted(self,
+                 fn: Callable[[AsyncOpenAI, str], Awaitable[Any]],
+                 labels: Dict[str, str],
+                 tokens: int = 0) -> Callable[[], Awaitable[Any]]:
+        """
+        _routed 的异步版本
+        """
+        tried: List[Endpoint] = []
+
+        async def _call():
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(tokens, label=labels["agent"])
+            endpoint = self.router.select(exclude=tried)
+            started = time.perf_counter()
+            try:
+                result = await fn(self._get_async_client(endpoint), endpoint.model or self.model)
+            except BaseException as e:
+                if isinstance(e, Exception) and self.retry.is_retryable(e):
+                    self.router.record_failure(endpoint)
+                    tried.append(endpoint)
+                else:
+                    self.router.release(endpoint)
+                raise
+            self.router.record_success(endpoint, time.perf_counter() - started)
+            return result
+
+        return _call
+
+    def _cache_key(self, message: List[Dict[str, str]], temperature: float, use_cache: bool) -> Optional[str]:
+        """
+        计算缓存键，不满足缓存条件时返回 None
+        """
+        if self.cache is None or not use_cache or temperature != 0:
+            return None
+        return LLMResponseCache.make_key(self.model, message, temperature)
+
+    def _coalesce_key(self, message: List[Dict[str, str]], temperature: float) -> Optional[str]:
+        """
+        计算在途请求合并的键，不满足合并条件时返回 None
+        """
+        if self.single_flight is None or temperature != 0:
+            return None
+        return LLMResponseCache.make_key(self.model, message, temperature)
+
+    def _fit_context(self, message: List[Dict[str, str]], label: Optional[str]) -> List[Dict[str, str]]:
+        if self.context_window is None:
+            return message
+        return self.context_window.fit(message, label=label or self.label)
+
+    def _labels(self, label: Optional[str]) -> Dict[str, str]:
+        return {"model": self.model, "agent": label or self.label}
+
+    def _stream_kwargs(self) -> Dict:
+        return {"stream_options": {"include_usage": True}} if self.stream_usage else {}
+
+    def _observe_call(self,
+                      labels: Dict[str, str],
+                      started: float,
+                      first_token_at: Optional[float],
+                      usage,
+                      error: bool,
+                      estimated_tokens: int = 0) -> None:
+        """
+        上报一次模型调用的耗时、首 token 延迟与 token 用量，并用实际用量修正限流器的预估
+        """
+        finished = time.perf_counter()
+        self.metrics.inc("llm_requests_total", **labels)
+        if error:
+            self.metrics.inc("llm_errors_total", **labels)
+        self.metrics.observe("llm_latency_seconds", finished - started, **labels)
+        if first_token_at is not None:
+            self.metrics.observe("llm_ttft_seconds", first_token_at - started, **labels)
+        if usage is not None:
+            if self.rate_limiter is not None and estimated_tokens:
+                self.rate_limiter.reconcile(estimated_tokens, usage.total_tokens or 0)
+            self.metrics.inc("llm_prompt_tokens_total", usage.prompt_tokens or 0, **labels)
+            self.metrics.inc("llm_completion_tokens_total", usage.completion_tokens or 0, **labels)
+            generation_seconds = finished - (first_token_at or started)
+            if usage.completion_tokens and generation_seconds > 0:
+                self.metrics.observe("llm_tokens_per_second", usage.completion_tokens / generation_seconds, **labels)
+
     def generate(self,
                  message: List[Dict[str, str]],
                  temperature: float = 0,
-                 stream: bool = False
+                 stream: bool = False,
+                 use_cache: bool = True,
+                 sink: StreamSink = None,
+                 quiet: bool = None,
+                 label: str = None
                  ) -> str:
         """
         调用大模型，生成回答
+
+        Args:
+            message: 对话消息
+            temperature: 采样温度
+            stream: 是否流式调用
+            use_cache: 是否使用响应缓存
+            sink: 回答内容的输出端，默认为带缓冲的标准输出
+            quiet: 静默模式，不做任何控制台输出，默认取实例配置
+            label: 指标标签，标识调用方，默认取实例配置
         """
-        print(f"================ 🧠 正在调用 {self.model} 模型 ================")
+        quiet = self.quiet if quiet is None else quiet
+        if sink is None:
+            sink = NullSink() if quiet else BufferedStdoutSink()
+        log = _silent if quiet else print
+
+        log(f"================ 🧠 正在调用 {self.model} 模型 ================")
+        message = self._fit_context(message, label)
+        cache_key = self._cache_key(message, temperature, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.metrics.inc("llm_cache_hits_total", **self._labels(label))
+                log("⚡ 命中响应缓存:")
+                sink.write(cached)
+                sink.end()
+                return cached
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=message,
-                temperature=temperature,
-                stream=stream
-            )
+            if stream:
+                collected_content = []
+                for content in self._stream(message, temperature, label):
+                    if not collected_content:
+                        log("✅ 大语言模型响应成功:")
+                    sink.write(content)
+                    collected_content.append(content)
+                content = "".join(collected_content)
+            else:
+                content = self._complete(message, temperature, label)
+                log("✅ 大语言模型响应成功:")
+                sink.write(content)
+            sink.end()
 
-            print("✅ 大语言模型响应成功:")
-            collected_content = []
-            for chunk in response:
-                content = chunk.choices[0].delta.content or ""
-                print(content, end="", flush=True)
-                collected_content.append(content)
-            # 输出结束后换行
-            print()
-            return "".join(collected_content)
+            if cache_key is not None:
+                self.cache.set(cache_key, content)
+            return content
         except Exception as e:
-            print(f"❌ 调用大模型失败: {e}")
+            sink.end()
+            log(f"❌ 调用大模型失败: {e}")
+            if self.raise_on_error:
+                raise
             return None
 
+    def _call_resilient(self,
+                        fn: Callable[[], Any],
+                        labels: Dict[str, str],
+                        hedge_metric: str,
+                        discard: Callable[[Any], None] = None) -> Any:
+        """
+        按重试、对冲与熔断配置执行一次请求
+
+        Args:
+            fn: 发起单次请求的函数
+            labels: 指标标签
+            hedge_metric: 用于计算对冲延迟的历史延迟指标
+            discard: 释放对冲落败请求结果的函数
+        """
+        def _attempt():
+            if self.hedge is None:
+                return fn()
+            delay = self.hedge.hedge_delay(self.metrics.histogram(hedge_metric, **labels))
+            return hedged_call(
+                fn, delay, self._hedge_executor, discard=discard,
+                on_hedge=lambda: self.metrics.inc("llm_hedged_requests_total", **labels)
+            )
+
+        return call_with_retry(
+            _attempt, self.retry, self.circuit_breaker,
+            on_retry=lambda attempt, error, delay: self.metrics.inc("llm_retries_total", **labels)
+        )
+
+    async def _acall_resilient(self,
+                               fn: Callable[[], Awaitable[Any]],
+                               labels: Dict[str, str],
+                               hedge_metric: str,
+                               discard: Callable[[Any], Awaitable[None]] = None) -> Any:
+        """
+        _call_resilient 的异步版本
+        """
+        async def _attempt():
+            if self.hedge is None:
+                return await fn()
+            delay = self.hedge.hedge_delay(self.metrics.histogram(hedge_metric, **labels))
+            return await ahedged_call(
+                fn, delay, discard=discard,
+                on_hedge=lambda: self.metrics.inc("llm_hedged_requests_total", **labels)
+            )
+
+        return await acall_with_retry(
+            _attempt, self.retry, self.circuit_breaker,
+            on_retry=lambda attempt, error, delay: self.metrics.inc("llm_retries_total", **labels)
+        )
+
+    def _complete(self, message: List[Dict[str, str]], temperature: float, label: Optional[str]) -> str:
+        """
+        非流式调用大模型，返回完整回答；相同的在途请求只会发出一次
+        """
+        key = self._coalesce_key(message, temperature)
+        if key is None:
+            return self._complete_upstream(message, temperature, label)
+        return self.single_flight.do(
+            key, lambda: self._complete_upstream(message, temperature, label), self._labels(label)
+        )
+
+    def _complete_upstream(self, message: List[Dict[str, str]], temperature: float, label: Optional[str]) -> str:
+        """
+        向服务端发起非流式调用
+        """
+        labels = self._labels(label)
+        tokens = estimate_tokens(message)
+        started = time.perf_counter()
+        try:
+            response = self._call_resilient(
+                self._routed(lambda client, model: client.chat.completions.create(
+                    model=model,
+                    messages=message,
+                    temperature=temperature
+                ), labels, tokens),
+                labels,
+                hedge_metric="llm_latency_seconds"
+            )
+        except Exception:
+            self._observe_call(labels, started, None, None, error=True)
+            raise
+        self._observe_call(labels, started, None, response.usage, error=False, estimated_tokens=tokens)
+        return response.choices[0].message.content or ""
+
+    async def _acomplete(self, message: List[Dict[str, str]], temperature: float, label: Optional[str]) -> str:
+        """
+        _complete 的异步版本
+        """
+        key = self._coalesce_key(message, temperature)
+        if key is None:
+            return await self._acomplete_upstream(message, temperature, label)
+        return await self.single_flight.ado(
+            key, lambda: self._acomplete_upstream(message, temperature, label), self._labels(label)
+        )
+
+    async def _acomplete_upstream(self,
+                                  message: List[Dict[str, str]],
+                                  temperature: float,
+                                  label: Optional[str]) -> str:
+        """
+        _complete_upstream 的异步版本
+        """
+        labels = self._labels(label)
+        tokens = estimate_tokens(message)
+        started = time.perf_counter()
+        try:
+            response = await self._acall_resilient(
+                self._arouted(lambda client, model: client.chat.completions.create(
+                    model=model,
+                    messages=message,
+                    temperature=temperature
+                ), labels, tokens),
+                labels,
+                hedge_metric="llm_latency_seconds"
+            )
+        except Exception:
+            self._observe_call(labels, started, None, None, error=True)
+            raise
+        self._observe_call(labels, started, None, response.usage, error=False, estimated_tokens=tokens)
+        return response.choices[0].message.content or ""
+
+    def _open_stream(self,
+                     client: OpenAI,
+                     model: str,
+                     message: List[Dict[str, str]],
+                     temperature: float) -> Tuple[Any, Iterator, List]:
+        """
+        发起流式请求并读到第一个有内容的数据块为止，返回 (响应, 剩余数据块迭代器, 已读取的数据块)
+
+        读到首个 token 才算请求成功，这样连接建立后立即失败的请求也能重试，对冲也以首 token 为准
+        """
+        response = client.chat.completions.create(
+            model=model,
+            messages=message,
+            temperature=temperature,
+            stream=True,
+            **self._stream_kwargs()
+        )
+        chunks = iter(response)
+        prefetched = []
+        try:
+            for chunk in chunks:
+                prefetched.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except Exception:
+            response.close()
+            raise
+        return response, chunks, prefetched
+
+    async def _aopen_stream(self,
+                            client: AsyncOpenAI,
+                            model: str,
+                            message: List[Dict[str, str]],
+                            temperature: float) -> Tuple[Any, AsyncIterator, List]:
+        """
+        _open_stream 的异步版本
+        """
+        response = await client.chat.completions.create(
+            model=model,
+            messages=message,
+            temperature=temperature,
+            stream=True,
+            **self._stream_kwargs()
+        )
+        chunks = response.__aiter__()
+        prefetched = []
+        try:
+            async for chunk in chunks:
+                prefetched.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except BaseException:
+            await response.close()
+            raise
+        return response, chunks, prefetched
+
+    def stream(self,
+               message: List[Dict[str, str]],
+               temperature: float = 0,
+               label: str = None
+               ) -> Iterator[str]:
+        """
+        流式调用大模型，逐块产出文本，不做任何控制台输出
+
+        调用失败时直接抛出异常；提前结束迭代会关闭底层连接，停止继续生成。
+        开启请求合并时，相同的在途请求共享同一个上游流，后加入者会先收到已生成的内容
+        """
+        yield from self._stream(self._fit_context(message, label), temperature, label)
+
+    def _stream(self, message: List[Dict[str, str]], temperature: float, label: Optional[str]) -> Iterator[str]:
+        key = self._coalesce_key(message, temperature)
+        if key is None:
+            yield from self._stream_upstream(message, temperature, label)
+        else:
+            yield from self.single_flight.stream(
+                key, lambda: self._stream_upstream(message, temperature, label), self._labels(label)
+            )
+
+    def _stream_upstream(self,
+                         message: List[Dict[str, str]],
+                         temperature: float,
+                         label: Optional[str]
+                         ) -> Iterator[str]:
+        """
+        向服务端发起流式调用
+
+        已经产出内容后的中途失败不会重试，避免下游收到重复内容
+        """
+        labels = self._labels(label)
+        tokens = estimate_tokens(message)
+        started = time.perf_counter()
+        first_token_at = None
+        usage = None
+        error = False
+        try:
+            response, chunks, prefetched = self._call_resilient(
+                self._routed(lambda client, model: self._open_stream(client, model, message, temperature),
+                             labels, tokens),
+                labels,
+                hedge_metric="llm_ttft_seconds",
+                discard=lambda opened: opened[0].close()
+            )
+            try:
+                for chunk in itertools.chain(prefetched, chunks):
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        yield chunk.choices[0].delta.content
+            finally:
+                response.close()
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._observe_call(labels, started, first_token_at, usage, error, estimated_tokens=tokens)
+
+    async def astream(self,
+                      message: List[Dict[str, str]],
+                      temperature: float = 0,
+                      label: str = None
+                      ) -> AsyncIterator[str]:
+        """
+        stream 的异步版本
+        """
+        chunks = self._astream(self._fit_context(message, label), temperature, label)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _astream(self,
+                       message: List[Dict[str, str]],
+                       temperature: float,
+                       label: Optional[str]) -> AsyncIterator[str]:
+        key = self._coalesce_key(message, temperature)
+        if key is None:
+            chunks = self._astream_upstream(message, temperature, label)
+        else:
+            chunks = self.single_flight.astream(
+                key, lambda: self._astream_upstream(message, temperature, label), self._labels(label)
+            )
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _astream_upstream(self,
+                                message: List[Dict[str, str]],
+                                temperature: float,
+                                label: Optional[str]
+                                ) -> AsyncIterator[str]:
+        """
+        _stream_upstream 的异步版本
+        """
+        labels = self._labels(label)
+        tokens = estimate_tokens(message)
+        started = time.perf_counter()
+        first_token_at = None
+        usage = None
+        error = False
+
+        async def _discard(opened) -> None:
+            await opened[0].close()
+
+        try:
+            response, chunks, prefetched = await self._acall_resilient(
+                self._arouted(lambda client, model: self._aopen_stream(client, model, message, temperature),
+                              labels, tokens),
+                labels,
+                hedge_metric="llm_ttft_seconds",
+                discard=_discard
+            )
+            try:
+                for chunk in prefetched:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        yield chunk.choices[0].delta.content
+                async for chunk in chunks:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        yield chunk.choices[0].delta.content
+            finally:
+                await response.close()
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._observe_call(labels, started, first_token_at, usage, error, estimated_tokens=tokens)
+
+    async def agenerate(self,
+                        message: List[Dict[str, str]],
+                        temperature: float = 0,
+                        stream: bool = False,
+                        use_cache: bool = True,
+                        label: str = None
+                        ) -> str:
+        """
+        异步调用大模型，生成回答
+
+        与 generate 不同，调用失败时直接抛出异常，由调用方决定如何处理
+        """
+        message = self._fit_context(message, label)
+        cache_key = self._cache_key(message, temperature, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.metrics.inc("llm_cache_hits_total", **self._labels(label))
+                return cached
+
+        if stream:
+            content = "".join([
+                chunk async for chunk in self._astream(message, temperature, label)
+            ])
+        else:
+            content = await self._acomplete(message, temperature, label)
+
+        if cache_key is not None:
+            self.cache.set(cache_key, content)
+        return content
+
+    async def agenerate_batch(self,
+                              messages_list: List[List[Dict[str, str]]],
+                              temperature: float = 0,
+                              max_concurrency: int = 8,
+                              label: str = None
+                              ) -> List[Union[str, Exception]]:
+        """
+        并发调用大模型，批量生成回答
+
+        Args:
+            messages_list: 多组对话消息
+            temperature: 采样温度
+            max_concurrency: 最大并发请求数
+        Returns:
+            与输入顺序一致的结果列表，成功为回答文本，失败为对应的异常对象
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _generate_one(message: List[Dict[str, str]]) -> str:
+            async with semaphore:
+                return await self.agenerate(message, temperature=temperature, label=label)
+
+        return await asyncio.gather(
+            *(_generate_one(message) for message in messages_list),
+            return_exceptions=True
+        )
+
+    def generate_batch(self,
+                       messages_list: List[List[Dict[str, str]]],
+                       temperature: float = 0,
+                       max_concurrency: int = 8,
+                       label: str = None
+                       ) -> List[Union[str, Exception]]:
+        """
+        agenerate_batch 的同步入口，供脚本直接调用
+        """
+        async def _run():
+            try:
+                return await self.agenerate_batch(
+                    messages_list, temperature=temperature, max_concurrency=max_concurrency, label=label
+                )
+            finally:
+                await self.aclose()
+
+        if not self.quiet:
+            print(f"================ 🧠 正在并发调用 {self.model} 模型 "
+                  f"({len(messages_list)} 个请求, 并发 {max_concurrency}) ================")
+        return asyncio.run(_run())
+
 
 if __name__ == "__main__":
     try:
-        llmClient = LLMClient(model="deepseek-chat")
+        llmClient = LLMClient(model="deepseek-chat", cache=LLMResponseCache())
 
         exampleMessages = [
             {"role": "system", "content": "你是一个 python 代码生成助手，请根据用户的需求生成 python 代码。"},
@@ -69,6 +759,21 @@ if __name__ == "__main__":
         if responseText:
             print("\n\n--- 完整模型响应 ---")
             print(responseText)
+        print(f"缓存统计: {llmClient.cache.stats()}")
+
+        print("\n--- 批量并发调用LLM ---")
+        batchMessages = [
+            [{"role": "user", "content": f"用一句话介绍 {topic}"}]
+            for topic in ["快速排序", "归并排序", "堆排序"]
+        ]
+        for i, result in enumerate(llmClient.generate_batch(batchMessages, max_concurrency=3)):
+            if isinstance(result, Exception):
+                print(f"[{i}] ❌ 调用失败: {result}")
+            else:
+                print(f"[{i}] {result}")
+
+        print("\n--- 调用指标 ---")
+        print(llmClient.metrics.to_json())
 
     except ValueError as e:
         print(e)
@@ -0,0 +1,133 @@
+import json
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    直方图指标，保留最近 max_samples 个样本用于计算分位数
+    """
+    def __init__(self, max_samples: int = 10000):
+        self.samples: Deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """
+        计算第 p 百分位数（最近邻取整法），无样本时返回 0
+        """
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class MetricsRegistry:
+    """
+    线程安全的指标注册表，按 (指标名, 标签) 维度汇总计数器与直方图
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, LabelKey]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        计数器累加
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        向直方图记录一个样本
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        with self._lock:
+            return self._histograms.get(self._key(name, labels), Histogram())
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        导出当前所有指标
+        """
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), **histogram.summary()}
+                for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0])
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def to_json(self, indent: int = 2) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=indent)
+
+    def dump(self, path: str) -> None:
+        """
+        将指标快照写入 JSON 文件
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# 进程内共享的默认注册表，未显式指定时所有 LLMClient 都上报到这里
+default_registry = MetricsRegistry()
+
+
+if __name__ == "__main__":
+    registry = MetricsRegistry()
+    for latency in [0.8, 1.2, 0.9, 3.5, 1.1]:
+        registry.observe("llm_latency_seconds", latency, agent="Planner")
+    registry.inc("llm_requests_total", 5, agent="Planner")
+    print(registry.to_json())
@@ -1,17 +1,33 @@
 import ast
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Optional
 
+from ContextWindow import SUMMARY_PREFIX, SUMMARY_PROMPT_TEMPLATE, ContextWindow, TokenCounter
+from LLMCache import LLMResponseCache
 from LLMClient import LLMClient
+from Metrics import MetricsRegistry, default_registry
 
 PLANNER_PROMPT_TEMPLATE = """
     你是一个顶级的 AI 规划专家。你的任务是将用户提出的复杂问题分解成一个由多个简单步骤组成的行动计划。
     请确保计划中的每个步骤都是一个独立的、可执行的子任务，并且严格按照逻辑顺序排列。
-    你的输出必须是一个Python列表，其中每个元素都是一个描述子任务的字符串。
+    你的输出必须是一个Python列表，其中每个元素是一个描述子任务的字典：id 为从 1 开始的步骤编号，
+    task 为子任务描述，deps 为该步骤需要用到其结果的前序步骤 id 列表。互不依赖的步骤（如分别查询两件事）
+    不要相互依赖，它们会被同时执行。
 
     问题: {question}
 
     请严格按照以下格式输出你的计划,```python与```作为前后缀是必要的:
     ```python
-    ["步骤1", "步骤2", "步骤3", ...]
+    [{{"id": 1, "task": "步骤1", "deps": []}}, {{"id": 2, "task": "步骤2", "deps": []}}, {{"id": 3, "task": "步骤3", "deps": [1, 2]}}, ...]
     ```
     """
 
@@ -36,9 +52,187 @@ EXECUTOR_PROMPT_TEMPLATE = """
     """
 
 
+class AgentEvent:
+    """
+    PlanAndSolveAgent.arun_events 产出的进度事件
+
+    - plan_token：规划模型输出的一段文本（data 为文本）
+    - plan_ready：计划生成完毕（data 为规范化后的步骤列表）；边规划边执行时，部分步骤可能已经开始
+    - step_started：步骤开始调用模型（step_id、data 为步骤描述）
+    - step_token：步骤输出的一段文本（自洽采样的步骤没有此事件）
+    - step_done：步骤完成（data 为 {"task", "result", "seconds", "from_checkpoint"}）
+    - error：执行失败（data 为错误信息）
+    - final：运行结束（data 为 RunResult）
+    """
+    PLAN_TOKEN = "plan_token"
+    PLAN_READY = "plan_ready"
+    STEP_STARTED = "step_started"
+    STEP_TOKEN = "step_token"
+    STEP_DONE = "step_done"
+    ERROR = "error"
+    FINAL = "final"
+
+    def __init__(self, type: str, data=None, step_id: int = None):
+        self.type = type
+        self.data = data
+        self.step_id = step_id
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        step = f", step_id={self.step_id}" if self.step_id is not None else ""
+        return f"AgentEvent({self.type}{step}, data={self.data!r})"
+
+
+class RunResult:
+    """
+    一次运行的最终结果：答案、计划，以及每个步骤的结果与耗时
+    """
+    def __init__(self, question: str):
+        self.question = question
+        self.answer = ""
+        self.plan: list[dict] = []
+        # 步骤 id -> {"task", "result", "seconds", "from_checkpoint"}
+        self.steps: dict[int, dict] = {}
+        self.plan_seconds: Optional[float] = None
+        self.total_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None and bool(self.answer)
+
+    def to_dict(self) -> dict:
+        return {
+            "question": self.question,
+            "answer": self.answer,
+            "success": self.success,
+            "error": self.error,
+            "plan": self.plan,
+            "steps": self.steps,
+            "plan_seconds": self.plan_seconds,
+            "total_seconds": self.total_seconds,
+        }
+
+
+# 英文单引号要求两侧不是字母数字，避免把 it's / Bob's 这类撇号当成引号
+_QUOTED_RE = r"“[^”]*”|「[^」]*」|《[^》]*》|\"[^\"]*\"|(?<![A-Za-z0-9])'[^'\n]+'(?![A-Za-z0-9])"
+# 只匹配独立的数字，gpt4、3D、v1.2 中的数字不算取值
+_NUMBER_RE = r"(?<![A-Za-z0-9.])\d+(?:\.\d+)?(?![A-Za-z0-9]|\.\d)"
+
+
+class PlanCache:
+    """
+    计划缓存：按问题的“形状”复用执行计划，模板化的问题变体无需再次调用规划模型
+
+    问题先归一化：合并空白（去掉中文前后的空格）、英文转小写，并把引号内容、已知实体（entities）和独立的数字替换为占位符；
+    写入时计划中出现的这些取值也被替换为槽位，命中时再填入新问题的取值。
+    “步骤N”“第N步”“step N”这类步骤引用中的编号属于计划结构，不当作取值。
+    存储复用 LLMResponseCache（SQLite，LRU 淘汰，可设置 ttl），命中率记录到 plan_cache_requests_total。
+    """
+    def __init__(self,
+                 path: str = "plan_cache.sqlite3",
+                 max_entries: int = 1000,
+                 ttl: Optional[float] = None,
+                 entities: list[str] = None,
+                 metrics: MetricsRegistry = None):
+        self.store = LLMResponseCache(path=path, max_entries=max_entries, ttl=ttl)
+        self.metrics = metrics or default_registry
+        # 步骤引用排在最前，先于数字匹配，从而原样保留
+        patterns = [("STEP", f"(?i:{_STEP_REF_RE.pattern})"), ("QUOTE", _QUOTED_RE)]
+        if entities:
+            # 长的实体优先匹配，避免“广州塔”被“广州”截断
+            patterns.append(("ENTITY", "|".join(re.escape(e) for e in sorted(entities, key=len, reverse=True))))
+        patterns.append(("NUM", _NUMBER_RE))
+        self._value_re = re.compile("|".join(f"(?P<{kind}>{p})" for kind, p in patterns))
+
+    def normalize(self, question: str) -> tuple[str, list[str]]:
+        """
+        :return: (归一化后的问题形状, 按出现顺序被替换掉的取值)
+        """
+        question = re.sub(r"\s+", " ", question.strip())
+        # 中文之间的空格没有意义
+        question = re.sub(r"(?<=[\u4e00-\u9fff，。？！]) | (?=[\u4e00-\u9fff，。？！])", "", question)
+        values = []
+
+        def _replace(match):
+            if match.lastgroup == "STEP":
+                return match.group(0)
+            values.append(match.group(0))
+            return f"<{match.lastgroup}>"
+
+        shape = self._value_re.sub(_replace, question).lower()
+        return shape, values
+
+    def get(self, question: str) -> Optional[list]:
+        shape, values = self.normalize(question)
+        cached = self.store.get(self._key(shape))
+        self.metrics.inc("plan_cache_requests_total", result="hit" if cached is not None else "miss")
+        if cached is None:
+            return None
+        return [self._fill(item, values) for item in json.loads(cached)]
+
+    def set(self, question: str, plan: list) -> None:
+        shape, values = self.normalize(question)
+        template = [self._templatize(item, values) for item in plan]
+        self.store.set(self._key(shape), json.dumps(template, ensure_ascii=False))
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+    @staticmethod
+    def _key(shape: str) -> str:
+        return hashlib.sha256(f"plan:{shape}".encode("utf-8")).hexdigest()
+
+    def _templatize(self, item, values: list[str]):
+        if isinstance(item, dict):
+            return {**item, "task": self._templatize(str(item.get("task") or item.get("step") or ""), values)}
+        text = str(item)
+        # 长的取值优先替换，数字只匹配独立的完整数字，步骤引用中的编号保持不变
+        for index, value in sorted(enumerate(values), key=lambda pair: len(pair[1]), reverse=True):
+            if re.fullmatch(_NUMBER_RE, value):
+                pattern = rf"(?P<STEP>(?i:{_STEP_REF_RE.pattern}))|(?<![A-Za-z0-9.]){re.escape(value)}(?![A-Za-z0-9]|\.\d)"
+            else:
+                pattern = re.escape(value)
+            text = re.sub(pattern, lambda m: m.group(0) if m.lastgroup == "STEP" else f"{{{{slot{index}}}}}", text)
+        return text
+
+    @staticmethod
+    def _fill(item, values: list[str]):
+        if isinstance(item, dict):
+            return {**item, "task": PlanCache._fill(item["task"], values)}
+        return re.sub(r"\{\{slot(\d+)\}\}", lambda m: values[int(m.group(1))], item)
+
+
+async def _closing(llm_client: LLMClient, coro: Awaitable):
+    """
+    供 asyncio.run 新建的事件循环使用：结束时关闭绑定在该循环上的异步客户端。
+    在调用方自己的事件循环中运行时（如 arun_events）客户端可能被其他运行共享，不能关闭
+    """
+    try:
+        return await coro
+    finally:
+        await llm_client.aclose()
+
+
 class Planner:
-    def __init__(self, llm_client: LLMClient):
+    def __init__(self, llm_client: LLMClient, plan_cache: PlanCache = None):
         self.llmClient = llm_client
+        # 可选的计划缓存，未传入时若设置了 PLAN_CACHE_PATH 则使用该路径
+        if plan_cache is None and os.getenv("PLAN_CACHE_PATH"):
+            plan_cache = PlanCache(path=os.getenv("PLAN_CACHE_PATH"))
+        self.plan_cache = plan_cache
+
+    def _cached(self, question) -> Optional[list]:
+        if self.plan_cache is None:
+            return None
+        plan_list = self.plan_cache.get(question)
+        if plan_list:
+            print(f"♻️ 命中计划缓存，跳过规划调用: {plan_list}")
+        return plan_list
+
+    def _remember(self, question, plan_list: list) -> None:
+        if self.plan_cache is not None and plan_list:
+            self.plan_cache.set(question, plan_list)
 
     def plan(self, question):
         """
@@ -46,15 +240,63 @@ class Planner:
         :param question: 问题
         :return: 执行计划
         """
+        cached = self._cached(question)
+        if cached:
+            return cached
+
         prompt = PLANNER_PROMPT_TEMPLATE.format(question=question)
 
         messages = [{"role": "user", "content": prompt}]
 
         print("====================== LLM正在生成执行计划... ======================")
 
-        response_txt = self.llmClient.generate(message=messages, stream=True) or ""
+        response_txt = self.llmClient.generate(message=messages, stream=True, label="Planner") or ""
         print(f"✅ 计划已生成: \n{response_txt}")
+        plan_list = self._parse(response_txt)
+        self._remember(question, plan_list)
+        return plan_list
 
+    async def aplan_stream(self, question, emit: Callable[[AgentEvent], None] = None) -> AsyncIterator:
+        """
+        流式生成执行计划，每个步骤在输出中完整出现后立即产出，执行器无需等待整个计划生成完毕；
+        流式解析没有得到任何步骤时，在生成结束后按完整文本再解析一次
+        :param emit: 可选的事件回调，接收 plan_token 与 plan_ready 事件
+        """
+        cached = self._cached(question)
+        if cached:
+            for item in cached:
+                yield item
+            if emit is not None:
+                emit(AgentEvent(AgentEvent.PLAN_READY, normalize_plan(cached)))
+            return
+
+        messages = [{"role": "user", "content": PLANNER_PROMPT_TEMPLATE.format(question=question)}]
+        parser = PlanStreamParser()
+        chunks = []
+        produced = []
+
+        print("====================== LLM正在流式生成执行计划... ======================")
+        async for chunk in self.llmClient.astream(messages, label="Planner"):
+            chunks.append(chunk)
+            if emit is not None:
+                emit(AgentEvent(AgentEvent.PLAN_TOKEN, chunk))
+            for item in parser.feed(chunk):
+                produced.append(item)
+                print(f"📝 已解析出步骤 {len(produced)}")
+                yield item
+        response_txt = "".join(chunks)
+        print(f"✅ 计划已生成: \n{response_txt}")
+
+        if not produced:
+            produced = self._parse(response_txt)
+            for item in produced:
+                yield item
+        self._remember(question, produced)
+        if emit is not None and produced:
+            emit(AgentEvent(AgentEvent.PLAN_READY, normalize_plan(produced)))
+
+    @staticmethod
+    def _parse(response_txt: str) -> list:
         # 解析模型输出
         try:
             plan_str = response_txt.split("```python")[1].split("```")[0].strip()
@@ -66,31 +308,467 @@ class Planner:
             return []
 
 
+class PlanStreamParser:
+    """
+    增量解析 ```python 代码块中的计划列表：逐块喂入模型输出，每当列表中的一个元素（字符串或字典）完整出现，
+    就用 ast.literal_eval 解析并返回它；只跟踪括号深度和字符串状态，不需要等到整个列表结束
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._quote = None
+        self._escape = False
+        self._item_start = None
+        self._started = False
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        self._buffer += chunk
+        items = []
+        if not self._started:
+            marker = self._buffer.find("```python")
+            bracket = self._buffer.find("[", marker + len("```python")) if marker >= 0 else -1
+            if bracket < 0:
+                return items
+            self._started = True
+            self._depth = 1
+            self._pos = bracket + 1
+
+        while not self.done and self._pos < len(self._buffer):
+            ch = self._buffer[self._pos]
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._quote:
+                    self._quote = None
+                    if self._depth == 1:
+                        items.extend(self._close_item(self._pos + 1))
+            elif ch in "\"'":
+                if self._depth == 1 and self._item_start is None:
+                    self._item_start = self._pos
+                self._quote = ch
+            elif ch in "[{(":
+                if self._depth == 1 and self._item_start is None:
+                    self._item_start = self._pos
+                self._depth += 1
+            elif ch in "]})":
+                self._depth -= 1
+                if self._depth == 1:
+                    items.extend(self._close_item(self._pos + 1))
+                elif self._depth == 0:
+                    self.done = True
+            self._pos += 1
+        return items
+
+    def _close_item(self, end: int) -> list:
+        text, self._item_start = self._buffer[self._item_start:end], None
+        try:
+            return [ast.literal_eval(text)]
+        except Exception as e:
+            print(f"⚠️ 跳过无法解析的步骤 {text!r}: {e}")
+            return []
+
+
+def _coerce_step(item, index: int) -> dict:
+    """
+    把计划中的单个元素转换为 {"id", "task", "deps"}；纯字符串视为依赖前一步
+    """
+    if isinstance(item, dict):
+        return {
+            "id": int(item.get("id", index)),
+            "task": str(item.get("task") or item.get("step") or ""),
+            "deps": [int(d) for d in item.get("deps") or []],
+        }
+    return {"id": index, "task": str(item), "deps": [index - 1] if index > 1 else []}
+
+
+def normalize_plan(plan: list) -> list[dict]:
+    """
+    把计划统一为 [{"id", "task", "deps"}] 形式：纯字符串列表视为依次依赖前一步的链；
+    去掉不存在的依赖，存在环时退化为按列表顺序执行的链
+    """
+    steps = [_coerce_step(item, i) for i, item in enumerate(plan, 1)]
+
+    ids = {step["id"] for step in steps}
+    for step in steps:
+        step["deps"] = [d for d in dict.fromkeys(step["deps"]) if d in ids and d != step["id"]]
+    if len(topological_order(steps)) != len(steps):
+        print("⚠️ 计划中的依赖存在环，按列表顺序依次执行")
+        for i, step in enumerate(steps):
+            step["deps"] = [steps[i - 1]["id"]] if i else []
+    return steps
+
+
+def topological_order(steps: list[dict]) -> list[dict]:
+    """
+    按依赖关系排序（Kahn 算法），同一层内保持原有顺序；存在环时返回的步骤数少于输入
+    """
+    by_id = {step["id"]: step for step in steps}
+    indegree = {step["id"]: len(step["deps"]) for step in steps}
+    dependents = {step["id"]: [] for step in steps}
+    for step in steps:
+        for dep in step["deps"]:
+            dependents[dep].append(step["id"])
+    ready = [step["id"] for step in steps if indegree[step["id"]] == 0]
+    order = []
+    while ready:
+        current = ready.pop(0)
+        order.append(by_id[current])
+        for child in dependents[current]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    return order
+
+
+def critical_path_length(steps: list[dict]) -> int:
+    """
+    关键路径长度（按步骤数）：即使并发不受限，也必须依次执行的最少轮数
+    """
+    depth = {}
+    for step in topological_order(steps):
+        depth[step["id"]] = 1 + max((depth[d] for d in step["deps"]), default=0)
+    return max(depth.values(), default=0)
+
+
+_STEP_REF_RE = re.compile(r"步骤\s*(\d+)|第\s*(\d+)\s*步|step\s*(\d+)", re.IGNORECASE)
+
+
+def format_plan(steps: list[dict]) -> str:
+    """
+    把计划格式化为紧凑的编号列表，代替直接拼接 Python 列表
+    """
+    return "\n".join(
+        f"{step['id']}. {step['task']}" + (f"（依赖步骤 {', '.join(map(str, step['deps']))}）" if step["deps"] else "")
+        for step in steps
+    )
+
+
+class HistoryPolicy:
+    """
+    执行历史的组织策略，避免每一步都携带全部历史导致 token 开销随步骤数平方增长
+
+    默认（recent=None 且没有 summarizer）所有步骤的结果都原样保留，与不使用策略时一致；压缩需要显式开启：
+    - 设置 recent 后，最近 recent 个步骤的结果原样保留；只提供 summarizer 时 recent 取 2
+    - 更早的步骤：提供 summarizer（通常是更便宜的模型）时压缩成滚动摘要，新增步骤只与上一次的摘要一起再压缩；
+      否则只保留步骤编号和结果的前 snippet_chars 个字符
+    - referenced_only=True 时只携带当前步骤引用到的结果（如“步骤 2”“第 3 步”，或 DAG 计划中的依赖），
+      当前步骤没有引用任何步骤时退回上面的规则
+    按依赖关系（DAG）执行时，默认只把直接依赖步骤的结果交给策略；include_ancestors=True 时改为所有间接依赖的前序步骤
+    """
+    def __init__(self,
+                 recent: Optional[int] = None,
+                 summarizer: LLMClient = None,
+                 referenced_only: bool = False,
+                 summary_tokens: int = 200,
+                 snippet_chars: int = 80,
+                 include_ancestors: bool = False):
+        self.recent = 2 if recent is None and summarizer is not None else recent
+        self.summarizer = summarizer
+        self.referenced_only = referenced_only
+        self.summary_tokens = summary_tokens
+        self.snippet_chars = snippet_chars
+        self.include_ancestors = include_ancestors
+        # 已摘要的步骤 id 序列 -> 摘要文本
+        self._summaries: dict[tuple, str] = {}
+
+    def build(self, entries: list[tuple], current_step: str = "", referenced: list = None) -> list[str]:
+        """
+        :param entries: 已完成步骤 [(id, task, result)]，按执行顺序排列
+        :param current_step: 当前步骤描述，用于识别其引用的步骤
+        :param referenced: 额外指定的引用步骤 id（如 DAG 计划中的依赖）
+        :return: 历史片段列表
+        """
+        if self.referenced_only:
+            ids = set(referenced or []) | self.referenced_ids(current_step)
+            picked = [entry for entry in entries if entry[0] in ids]
+            if picked:
+                return [self._verbatim(entry) for entry in picked]
+
+        split = max(len(entries) - self.recent, 0) if self.recent is not None else 0
+        older, recent = entries[:split], entries[split:]
+        parts = []
+        if older:
+            if self.summarizer is not None:
+                summary = self._summarize(older)
+                parts.append(SUMMARY_PREFIX + summary if summary else self._snippets(older))
+            else:
+                parts.append(self._snippets(older))
+        return parts + [self._verbatim(entry) for entry in recent]
+
+    @staticmethod
+    def referenced_ids(text: str) -> set[int]:
+        return {int(next(g for g in match.groups() if g)) for match in _STEP_REF_RE.finditer(text or "")}
+
+    @staticmethod
+    def _verbatim(entry: tuple) -> str:
+        return f"步骤 {entry[0]}: {entry[1]}\n结果：{entry[2]}"
+
+    def _snippets(self, entries: list[tuple]) -> str:
+        lines = []
+        # 步骤描述已经在完整计划中，这里只保留编号和截断后的结果
+        for step_id, _, result in entries:
+            result = str(result).replace("\n", " ")
+            if len(result) > self.snippet_chars:
+                result = result[:self.snippet_chars] + "……"
+            lines.append(f"{step_id}. {result}")
+        return "【较早步骤的结果（已截断）】\n" + "\n".join(lines)
+
+    def _summarize(self, entries: list[tuple]) -> str:
+        ids = tuple(entry[0] for entry in entries)
+        if ids in self._summaries:
+            return self._summaries[ids]
+
+        # 找到已有的最长前缀摘要，只压缩新增的步骤
+        prefix = max((key for key in self._summaries if ids[:len(key)] == key), key=len, default=())
+        contents = [self._verbatim(entry) for entry in entries[len(prefix):]]
+        if prefix:
+            contents.insert(0, SUMMARY_PREFIX + self._summaries[prefix])
+
+        prompt = SUMMARY_PROMPT_TEMPLATE.format(max_tokens=self.summary_tokens, content="\n\n".join(contents))
+        summary = self.summarizer.generate(
+            [{"role": "user", "content": prompt}], quiet=True, label="Executor.HistorySummarizer"
+        )
+        if summary:
+            self._summaries[ids] = summary
+        return summary
+
+
+class SelfConsistency:
+    """
+    自洽采样：对推理类步骤以 temperature 并发采样 samples 个回答，按归一化后的答案多数投票
+
+    多个采样同时发出，墙钟耗时接近单次调用；最高票占比低于 agreement 时每次再追加 escalate_by 个采样，
+    发出的采样总数（含失败的）不超过 max_samples，某一轮全部失败时停止。
+    step_filter 用于只对部分步骤开启（参数为步骤描述），默认所有步骤。
+    投票的一致率和采样数记录到 self_consistency_agreement / self_consistency_samples。
+    """
+    def __init__(self,
+                 samples: int = 3,
+                 temperature: float = 0.7,
+                 agreement: float = 0.6,
+                 escalate_by: int = 2,
+                 max_samples: int = 7,
+                 step_filter: Callable[[str], bool] = None):
+        self.samples = samples
+        self.temperature = temperature
+        self.agreement = agreement
+        self.escalate_by = escalate_by
+        self.max_samples = max_samples
+        self.step_filter = step_filter
+
+    def applies_to(self, task: str) -> bool:
+        return self.step_filter is None or self.step_filter(task)
+
+    @staticmethod
+    def normalize_answer(text: str) -> str:
+        """
+        投票用的归一化：全角转半角、英文转小写，去掉空白和标点
+        """
+        text = unicodedata.normalize("NFKC", text).lower()
+        return "".join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+    async def asample(self, llm_client: LLMClient, messages: list[dict], label: str = None) -> Optional[str]:
+        """
+        :return: 得票最多的回答（取该答案的第一个原始文本）；所有采样都失败时返回 None
+        """
+        answers = []
+        # 预算按已发出的采样数计算，失败的采样同样计入，避免持续失败时无限重采
+        attempted = 0
+        need = min(self.samples, self.max_samples)
+        while need > 0:
+            batch = await llm_client.agenerate_batch(
+                [messages] * need, temperature=self.temperature, max_concurrency=need, label=label
+            )
+            attempted += need
+            added = [answer for answer in batch if isinstance(answer, str) and answer.strip()]
+            if not added:
+                print(f"❌ 本轮 {need} 个采样全部失败，停止采样")
+                break
+            answers.extend(added)
+            winner, votes = self._vote(answers)
+            if votes / len(answers) >= self.agreement:
+                break
+            need = min(self.escalate_by, self.max_samples - attempted)
+            if need > 0:
+                print(f"🗳️ 一致率 {votes}/{len(answers)} 偏低，追加 {need} 个采样")
+
+        winner, votes = self._vote(answers)
+        if winner is None:
+            return None
+        llm_client.metrics.observe("self_consistency_samples", len(answers), agent=label)
+        llm_client.metrics.observe("self_consistency_agreement", votes / len(answers), agent=label)
+        print(f"🗳️ {len(answers)} 个采样中 {votes} 个一致")
+        return next(answer for answer in answers if self.normalize_answer(answer) == winner)
+
+    def sample(self, llm_client: LLMClient, messages: list[dict], label: str = None) -> Optional[str]:
+        """
+        asample 的同步入口
+        """
+        async def _run():
+            try:
+                return await self.asample(llm_client, messages, label=label)
+            finally:
+                await llm_client.aclose()
+
+        return asyncio.run(_run())
+
+    def _vote(self, answers: list[str]) -> tuple:
+        if not answers:
+            return None, 0
+        return Counter(self.normalize_answer(answer) for answer in answers).most_common(1)[0]
+
+
+class RunCheckpoint:
+    """
+    Plan-and-Solve 运行检查点：追加写入 JSONL，每条记录写入后立即 fsync，进程中途退出也不会丢失已完成的步骤
+
+    记录类型：start（问题）、plan（规范化后的计划）、step（单个步骤的结果）、done（最终答案）。
+    同一个文件可以保存多次运行，按 run_id 区分；最后一行写到一半时读取会被忽略。
+    """
+    def __init__(self, path: str, run_id: str = None):
+        self.path = path
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._checked_tail = False
+
+    def start(self, question: str) -> None:
+        self._append({"type": "start", "question": question})
+
+    def save_plan(self, steps: list[dict]) -> None:
+        self._append({"type": "plan", "steps": steps})
+
+    def save_step(self, step: dict, result: str) -> None:
+        self._append({"type": "step", "id": step["id"], "task": step["task"], "result": result})
+
+    def finish(self, answer: str) -> None:
+        self._append({"type": "done", "answer": answer})
+
+    def _append(self, record: dict) -> None:
+        line = json.dumps({"run_id": self.run_id, "ts": time.time(), **record}, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            if not self._checked_tail:
+                # 上次运行退出时最后一行可能只写了一半，先换行，避免新记录与之粘连
+                self._checked_tail = True
+                if f.tell() and not self._ends_with_newline():
+                    f.write("\n")
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    @classmethod
+    def load(cls, path: str, run_id: str = None) -> Optional[dict]:
+        """
+        读取某次运行的状态，未指定 run_id 时取文件中最后一次运行
+        :return: {"run_id", "question", "plan", "results": {步骤 id: (task, result)}, "answer"}，没有记录时返回 None
+        """
+        runs = {}
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                state = runs.setdefault(record["run_id"], {
+                    "run_id": record["run_id"], "question": None, "plan": None, "results": {}, "answer": None
+                })
+                # 重新插入，使字典顺序反映最近写入的运行
+                runs[record["run_id"]] = runs.pop(record["run_id"])
+                if record["type"] == "start":
+                    state["question"] = record["question"]
+                elif record["type"] == "plan":
+                    state["plan"] = record["steps"]
+                elif record["type"] == "step":
+                    state["results"][record["id"]] = (record["task"], record["result"])
+                elif record["type"] == "done":
+                    state["answer"] = record["answer"]
+        if run_id is not None:
+            return runs.get(run_id)
+        return list(runs.values())[-1] if runs else None
+
+
 class Executor:
 
-    def __init__(self, llm_client: LLMClient):
+    def __init__(self,
+                 llm_client: LLMClient,
+                 context_window: ContextWindow = None,
+                 max_concurrency: int = 4,
+                 history_policy: HistoryPolicy = None,
+                 self_consistency: SelfConsistency = None):
         self.llm_client = llm_client
+        # 可选的自洽采样，开启后匹配的步骤并发采样多个回答并投票
+        self.self_consistency = self_consistency
+        # 可选的上下文窗口，历史执行结果超出 token 预算时裁剪较早的步骤
+        self.context_window = context_window
+        # 按依赖关系执行时同时进行的步骤数上限
+        self.max_concurrency = max_concurrency
+        # 历史组织策略，默认原样保留全部历史，需要截断或摘要时传入设置了 recent 的 HistoryPolicy
+        self.history_policy = history_policy or HistoryPolicy()
+        self.counter = context_window.counter if context_window is not None else TokenCounter()
+
+    def execute(self, question: str, plan: list, checkpoint: RunCheckpoint = None, completed: dict = None) -> str:
+        """
+        执行计划：各步骤依次依赖前一步时按顺序执行并携带全部历史；
+        否则按依赖关系（DAG）调度，依赖已就绪的步骤并发执行，每个步骤只携带其直接依赖步骤的结果
+        （history_policy 设置 include_ancestors=True 时携带所有间接依赖的前序步骤）
+        :param checkpoint: 每完成一个步骤就写入检查点
+        :param completed: 已完成的步骤 {步骤 id: 结果}，这些步骤不再调用模型
+        """
+        steps = normalize_plan(plan)
+        if checkpoint is not None:
+            checkpoint.save_plan(steps)
+        if all(step["deps"] == ([steps[i - 1]["id"]] if i else []) for i, step in enumerate(steps)):
+            return self._execute_sequential(question, steps, checkpoint, completed or {})
+        return asyncio.run(_closing(self.llm_client, self._execute_dag(question, steps, checkpoint, completed or {})))
 
-    def execute(self, question: str, plan: list[str]) -> str:
-        # 用于存储历史执行结果
-        history = ""
+    def _execute_sequential(self, question: str, steps: list[dict], checkpoint: RunCheckpoint, completed: dict) -> str:
+        plan_text = format_plan(steps)
+        # 已完成的步骤 (id, task, result)
+        history = []
         response_text = ""
-        for i, step in enumerate(plan):
+        for i, step_info in enumerate(steps):
+            step = step_info["task"]
+            if step_info["id"] in completed:
+                response_text = completed[step_info["id"]]
+                history.append((step_info["id"], step, response_text))
+                print(f"⏭️ 步骤 {i + 1} [ {step} ] 已在检查点中完成，跳过")
+                continue
             print(f"------- 正在执行计划 {i} ------")
 
+            history_text = self._format_history(self.history_policy.build(history, current_step=step))
             prompt = EXECUTOR_PROMPT_TEMPLATE.format(
                 question=question,
-                plan=plan,
-                history=history if history else "无",
+                plan=plan_text,
+                history=history_text,
                 current_step=step
             )
+            self._log_tokens(i + 1, prompt, history_text)
 
             messages = [{"role": "user", "content": prompt}]
 
-            response_text = self.llm_client.generate(message=messages, stream=True) or ""
+            if self.self_consistency is not None and self.self_consistency.applies_to(step):
+                response_text = self.self_consistency.sample(self.llm_client, messages, label="Executor")
+            else:
+                response_text = self.llm_client.generate(message=messages, stream=True, label="Executor")
+            if response_text is None:
+                # 重试后仍然失败，继续执行后续步骤只会基于错误的历史浪费调用
+                print(f"❌ 步骤 {i + 1} [ {step} ] 调用失败，终止执行")
+                return ""
 
             # 更新历史执行，为下一步做准备
-            history += f"步骤 {i + 1}: {step}\n结果：{response_text}\n\n"
+            history.append((step_info["id"], step, response_text))
+            if checkpoint is not None:
+                checkpoint.save_step(step_info, response_text)
 
             print(f"步骤 {i + 1} [ {step} ]  已完成，结果：{response_text}\n")
 
@@ -98,31 +776,329 @@ class Executor:
         # 最后一步就是最终答案
         return response_text
 
+    async def _execute_dag(self, question: str, steps: list[dict], checkpoint: RunCheckpoint, completed: dict) -> str:
+        async def _steps():
+            # 按拓扑序产出，保证每个步骤调度时其依赖已被调度
+            for step in topological_order(steps):
+                yield step
+        return await self._run_steps(question, _steps(), planning=False, checkpoint=checkpoint, completed=completed)
+
+    async def aexecute_stream(self,
+                              question: str,
+                              plan_items: AsyncIterable,
+                              checkpoint: RunCheckpoint = None,
+                              emit: Callable[[AgentEvent], None] = None) -> str:
+        """
+        边生成计划边执行：plan_items 每产出一个步骤就立即调度，依赖已完成的步骤不必等待计划生成结束。
+        只允许依赖已经出现过的步骤，其余依赖会被忽略；计划在生成结束后才写入检查点
+        :param emit: 可选的事件回调，接收 step_started / step_token / step_done / error 事件
+        """
+        async def _steps():
+            known = set()
+            index = 0
+            async for item in plan_items:
+                index += 1
+                step = _coerce_step(item, index)
+                if step["id"] in known:
+                    print(f"⚠️ 步骤编号 {step['id']} 重复，已跳过")
+                    continue
+                step["deps"] = [d for d in dict.fromkeys(step["deps"]) if d in known]
+                known.add(step["id"])
+                yield step
+        return await self._run_steps(question, _steps(), planning=True, checkpoint=checkpoint, completed={}, emit=emit)
+
+    async def _run_steps(self,
+                         question: str,
+                         source: AsyncIterable,
+                         planning: bool,
+                         checkpoint: RunCheckpoint,
+                         completed: dict,
+                         emit: Callable[[AgentEvent], None] = None) -> str:
+        # 有订阅方时逐块流式调用，否则走可命中响应缓存的 agenerate
+        stream_tokens = emit is not None
+        emit = emit or (lambda event: None)
+        steps = []
+        by_id = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = {}
+        latencies = {}
+        tasks = {}
+        step_started = {}
+        plan_done_at = None
+
+        def _ancestors(step: dict) -> list[int]:
+            seen, stack = set(), list(step["deps"])
+            while stack:
+                current = stack.pop()
+                if current not in seen:
+                    seen.add(current)
+                    stack.extend(by_id[current]["deps"])
+            return sorted(seen, key=lambda d: steps.index(by_id[d]))
+
+        async def _run_step(step: dict) -> str:
+            if step["id"] in completed:
+                results[step["id"]] = completed[step["id"]]
+                print(f"⏭️ 步骤 {step['id']} [ {step['task']} ] 已在检查点中完成，跳过")
+                emit(AgentEvent(AgentEvent.STEP_DONE, {
+                    "task": step["task"], "result": results[step["id"]], "seconds": 0.0, "from_checkpoint": True
+                }, step_id=step["id"]))
+                return results[step["id"]]
+            if step["deps"]:
+                await asyncio.gather(*(tasks[d] for d in step["deps"]))
+            # 默认只携带直接依赖步骤的结果，历史策略开启 include_ancestors 时携带所有前序步骤；
+            # 摘要可能调用模型，放到线程里避免阻塞其他步骤
+            history_ids = _ancestors(step) if self.history_policy.include_ancestors else step["deps"]
+            history = [(d, by_id[d]["task"], results[d]) for d in history_ids]
+            parts = await asyncio.to_thread(
+                self.history_policy.build, history, current_step=step["task"], referenced=step["deps"]
+            )
+            history_text = self._format_history(parts)
+            plan_text = format_plan(steps)
+            if plan_done_at is None and planning:
+                plan_text += "\n……（计划仍在生成中）"
+            prompt = EXECUTOR_PROMPT_TEMPLATE.format(
+                question=question,
+                plan=plan_text,
+                history=history_text,
+                current_step=step["task"]
+            )
+            self._log_tokens(step["id"], prompt, history_text)
+            async with semaphore:
+                print(f"------- 正在执行计划 {step['id']} ------")
+                step_started[step["id"]] = time.perf_counter()
+                emit(AgentEvent(AgentEvent.STEP_STARTED, step["task"], step_id=step["id"]))
+                messages = [{"role": "user", "content": prompt}]
+                if self.self_consistency is not None and self.self_consistency.applies_to(step["task"]):
+                    result = await self.self_consistency.asample(self.llm_client, messages, label="Executor")
+                elif not stream_tokens:
+                    result = await self.llm_client.agenerate(messages, label="Executor")
+                else:
+                    # 逐块转发给事件订阅方，同时拼出完整结果
+                    chunks = []
+                    async for chunk in self.llm_client.astream(messages, label="Executor"):
+                        chunks.append(chunk)
+                        emit(AgentEvent(AgentEvent.STEP_TOKEN, chunk, step_id=step["id"]))
+                    result = "".join(chunks)
+                latencies[step["id"]] = time.perf_counter() - step_started[step["id"]]
+            if result is None:
+                raise RuntimeError(f"步骤 {step['id']} [ {step['task']} ] 调用失败")
+            results[step["id"]] = result
+            if checkpoint is not None:
+                checkpoint.save_step(step, result)
+            emit(AgentEvent(AgentEvent.STEP_DONE, {
+                "task": step["task"], "result": result, "seconds": latencies[step["id"]], "from_checkpoint": False
+            }, step_id=step["id"]))
+            print(f"步骤 {step['id']} [ {step['task']} ]  已完成，结果：{result}\n")
+            return result
+
+        started = time.perf_counter()
+        try:
+            async for step in source:
+                steps.append(step)
+                by_id[step["id"]] = step
+                tasks[step["id"]] = asyncio.ensure_future(_run_step(step))
+            plan_done_at = time.perf_counter()
+            if planning and checkpoint is not None:
+                checkpoint.save_plan(steps)
+            await asyncio.gather(*tasks.values())
+        except Exception as e:
+            print(f"❌ 执行计划时调用失败: {e}，终止执行")
+            emit(AgentEvent(AgentEvent.ERROR, str(e)))
+            return ""
+        finally:
+            # 出错或自身被取消（包括 KeyboardInterrupt）时，取消尚未结束的步骤并等待它们真正退出
+            pending = [task for task in tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if not steps:
+            print("❌ 没有可执行的步骤")
+            return ""
+
+        elapsed = time.perf_counter() - started
+        print("------- 计划执行完毕 --------")
+        print(f"📐 共 {len(steps)} 个步骤，关键路径 {critical_path_length(steps)} 步；"
+              f"实际耗时 {elapsed:.2f}s，各步骤耗时之和 {sum(latencies.values()):.2f}s")
+        if planning:
+            early = [d for d, t in step_started.items() if t < plan_done_at]
+            print(f"⚡ 计划生成耗时 {plan_done_at - started:.2f}s，"
+                  f"生成结束前已开始执行 {len(early)} 个步骤")
+        print()
+        # 没有被其他步骤依赖的最后一个步骤就是最终答案
+        depended = {d for step in steps for d in step["deps"]}
+        final_step = [step for step in steps if step["id"] not in depended][-1]
+        return results[final_step["id"]]
+
+    def _format_history(self, history: list[str]) -> str:
+        if not history:
+            return "无"
+        if self.context_window is not None:
+            history = self.context_window.fit_texts(history, label="Executor")
+        return "\n\n".join(history)
+
+    def _log_tokens(self, step_id, prompt: str, history_text: str):
+        prompt_tokens = self.counter.count(prompt)
+        history_tokens = self.counter.count(history_text)
+        self.llm_client.metrics.observe("executor_prompt_tokens", prompt_tokens, part="total")
+        self.llm_client.metrics.observe("executor_prompt_tokens", history_tokens, part="history")
+        print(f"🧮 步骤 {step_id} 提示词约 {prompt_tokens} tokens，其中历史 {history_tokens} tokens")
+
 
 class PlanAndSolveAgent:
 
-    def __init__(self, llm_client: LLMClient):
+    def __init__(self,
+                 llm_client: LLMClient,
+                 context_window: ContextWindow = None,
+                 history_policy: HistoryPolicy = None,
+                 plan_cache: PlanCache = None,
+                 self_consistency: SelfConsistency = None):
         self.llm_client = llm_client
-        self.planner = Planner(llm_client)
-        self.executor = Executor(llm_client)
+        self.planner = Planner(llm_client, plan_cache=plan_cache)
+        self.executor = Executor(llm_client,
+                                 context_window=context_window,
+                                 history_policy=history_policy,
+                                 self_consistency=self_consistency)
 
-    def run(self, question: str):
+    def run(self, question: str, speculative: bool = False, checkpoint_path: str = None):
+        """
+        :param speculative: 为 True 时边流式生成计划边执行已就绪的步骤，缩短长计划的端到端耗时
+        :param checkpoint_path: 检查点文件，每完成一个步骤追加一条记录，进程退出后可用 resume 继续
+        """
         print(f'\n--------- 开始处理问题 --------- \n {question}')
 
-        # 1.调用规划器生成执行计划
-        ex_plan = self.planner.plan(question)
+        checkpoint = None
+        if checkpoint_path:
+            checkpoint = RunCheckpoint(checkpoint_path)
+            checkpoint.start(question)
+            print(f"💾 检查点: {checkpoint_path}（run_id={checkpoint.run_id}）")
+
+        if speculative:
+            response_text = asyncio.run(_closing(
+                self.llm_client,
+                self.executor.aexecute_stream(question, self.planner.aplan_stream(question), checkpoint=checkpoint)
+            ))
+        else:
+            # 1.调用规划器生成执行计划
+            ex_plan = self.planner.plan(question)
+
+            if not ex_plan:
+                print("❌ 无法生成执行计划，请检查问题或联系管理员")
+                return
 
+            # 2.调用执行器执行计划
+            response_text = self.executor.execute(question, ex_plan, checkpoint=checkpoint)
+
+        self._finish(checkpoint, response_text)
+        print(f"最终结果：\n{response_text}")
+        return response_text
+
+    async def arun_events(self,
+                          question: str,
+                          speculative: bool = True,
+                          checkpoint_path: str = None) -> AsyncIterator[AgentEvent]:
+        """
+        以异步事件流的形式运行，调用方可以边接收边渲染进度或启动下游工作；
+        最后一个事件为 final，其 data 是包含每个步骤结果与耗时的 RunResult。提前停止迭代会取消仍在进行的步骤
+        :param speculative: 为 True 时边规划边执行，否则等 plan_ready 之后再开始执行
+        """
+        result = RunResult(question)
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        started = time.perf_counter()
+
+        checkpoint = None
+        if checkpoint_path:
+            checkpoint = RunCheckpoint(checkpoint_path)
+            checkpoint.start(question)
+
+        async def _drive():
+            try:
+                plan_items = self.planner.aplan_stream(question, emit=queue.put_nowait)
+                if not speculative:
+                    items = [item async for item in plan_items]
+
+                    async def _replay():
+                        for item in items:
+                            yield item
+                    plan_items = _replay()
+                result.answer = await self.executor.aexecute_stream(
+                    question, plan_items, checkpoint=checkpoint, emit=queue.put_nowait
+                )
+                self._finish(checkpoint, result.answer)
+            except Exception as e:
+                queue.put_nowait(AgentEvent(AgentEvent.ERROR, str(e)))
+            finally:
+                queue.put_nowait(finished)
+
+        driver = asyncio.ensure_future(_drive())
+        try:
+            while True:
+                event = await queue.get()
+                if event is finished:
+                    break
+                if event.type == AgentEvent.PLAN_READY:
+                    result.plan = event.data
+                    result.plan_seconds = time.perf_counter() - started
+                elif event.type == AgentEvent.STEP_DONE:
+                    result.steps[event.step_id] = event.data
+                elif event.type == AgentEvent.ERROR:
+                    result.error = event.data
+                yield event
+            await driver
+        finally:
+            if not driver.done():
+                driver.cancel()
+                await asyncio.gather(driver, return_exceptions=True)
+
+        result.total_seconds = time.perf_counter() - started
+        if not result.answer and result.error is None:
+            result.error = "没有可执行的步骤"
+        yield AgentEvent(AgentEvent.FINAL, result)
+
+    def resume(self, checkpoint_path: str, run_id: str = None):
+        """
+        从检查点继续一次中断的运行，已完成的步骤直接复用结果，从第一个未完成的步骤开始执行。
+        计划还没写入检查点（如流式规划中途退出）时重新规划，编号和描述都一致的已完成步骤仍会被复用
+        :param run_id: 要继续的运行，默认取检查点文件中最后一次运行
+        """
+        state = RunCheckpoint.load(checkpoint_path, run_id)
+        if state is None or state["question"] is None:
+            print(f"❌ 检查点 {checkpoint_path} 中没有可继续的运行")
+            return
+        if state["answer"] is not None:
+            print(f"✅ 运行 {state['run_id']} 已经完成，最终结果：\n{state['answer']}")
+            return state["answer"]
+
+        question = state["question"]
+        print(f"\n--------- 从检查点继续（run_id={state['run_id']}，已完成 {len(state['results'])} 个步骤）--------- \n {question}")
+        checkpoint = RunCheckpoint(checkpoint_path, run_id=state["run_id"])
+
+        ex_plan = state["plan"] or self.planner.plan(question)
         if not ex_plan:
             print("❌ 无法生成执行计划，请检查问题或联系管理员")
             return
+        tasks = {step["id"]: step["task"] for step in normalize_plan(ex_plan)}
+        completed = {
+            step_id: result for step_id, (task, result) in state["results"].items() if tasks.get(step_id) == task
+        }
 
-        # 2.调用执行器执行计划
-        response_text = self.executor.execute(question, ex_plan)
-
+        response_text = self.executor.execute(question, ex_plan, checkpoint=checkpoint, completed=completed)
+        self._finish(checkpoint, response_text)
         print(f"最终结果：\n{response_text}")
+        return response_text
+
+    @staticmethod
+    def _finish(checkpoint: Optional[RunCheckpoint], response_text: str) -> None:
+        # 失败的运行不写入 done，之后仍可继续
+        if checkpoint is not None and response_text:
+            checkpoint.finish(response_text)
 
 
 if __name__ == '__main__':
     llm_client = LLMClient(model="deepseek-chat")
-    psa = PlanAndSolveAgent(llm_client)
+    # 亲属关系推理容易出错，对每个步骤并发采样 3 次并投票
+    psa = PlanAndSolveAgent(llm_client, self_consistency=SelfConsistency(samples=3))
     psa.run("爷爷的奶奶的奶奶的爸爸的姐姐的儿子是谁？")
+    print(llm_client.metrics.to_json())
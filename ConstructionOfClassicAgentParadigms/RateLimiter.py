@@ -0,0 +1,236 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from Metrics import MetricsRegistry, default_registry
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], completion_tokens: int = 512) -> int:
+    """
+    粗略估算一次请求消耗的 token 数：提示词按每 3 个字符 1 个 token 计算，再加上预留的回答长度
+    """
+    chars = sum(len(str(message.get("content") or "")) for message in messages)
+    return math.ceil(chars / 3) + 4 * len(messages) + completion_tokens
+
+
+class TokenBucket:
+    """
+    令牌桶：容量 capacity，每秒补充 refill_rate 个令牌
+    """
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        距离桶内令牌足够 amount 还需等待的秒数，超过容量的请求按容量计算
+        """
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.refill_rate)
+
+    def consume(self, amount: float) -> None:
+        # 允许透支为负数，大请求之后的调用会相应等待更久
+        self._refill()
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """
+    客户端限流器，同时按每分钟请求数（RPM）和每分钟 token 数（TPM）限流
+
+    调用方按到达顺序排队（FIFO），队首的配额不足时后面的请求不会插队。
+    排队等待时长会作为 llm_rate_limit_wait_seconds 指标上报。
+    """
+    def __init__(self, rpm: float = None, tpm: float = None, metrics: MetricsRegistry = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_bucket = TokenBucket(rpm, rpm / 60) if rpm else None
+        self.token_bucket = TokenBucket(tpm, tpm / 60) if tpm else None
+        self.metrics = metrics or default_registry
+
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket and tokens:
+            wait = max(wait, self.token_bucket.wait_time(tokens))
+        return wait
+
+    def _consume(self, tokens: int) -> None:
+        if self.request_bucket:
+            self.request_bucket.consume(1)
+        if self.token_bucket and tokens:
+            self.token_bucket.consume(tokens)
+
+    def _advance(self) -> None:
+        """
+        轮到下一个排队者，跳过已放弃的号码
+        """
+        self._serving += 1
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
+        self._cond.notify_all()
+
+    def _take_ticket(self) -> int:
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            return ticket
+
+    def _try_acquire(self, ticket: int, tokens: int) -> Optional[float]:
+        """
+        尝试为 ticket 扣减配额：成功返回 None；配额不足返回需等待的秒数；尚未轮到返回 -1
+        """
+        if self._serving != ticket:
+            return -1.0
+        wait = self._wait_time(tokens)
+        if wait > 0:
+            return wait
+        self._consume(tokens)
+        self._advance()
+        return None
+
+    def _abandon(self, ticket: int) -> None:
+        with self._cond:
+            if self._serving == ticket:
+                self._advance()
+            elif ticket > self._serving:
+                self._abandoned.add(ticket)
+
+    def acquire(self, tokens: int = 0, label: str = None) -> float:
+        """
+        阻塞直到获得 1 个请求配额和 tokens 个 token 配额，返回排队等待的秒数
+        """
+        started = time.monotonic()
+        ticket = self._take_ticket()
+        try:
+            with self._cond:
+                while True:
+                    wait = self._try_acquire(ticket, tokens)
+                    if wait is None:
+                        break
+                    self._cond.wait(timeout=wait if wait > 0 else None)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        return self._observe_wait(started, label)
+
+    async def aacquire(self, tokens: int = 0, label: str = None) -> float:
+        """
+        acquire 的异步版本，与同步调用方共用同一个队列
+        """
+        started = time.monotonic()
+        ticket = self._take_ticket()
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire(ticket, tokens)
+                if wait is None:
+                    break
+                # 未轮到自己时短暂让出事件循环后重试
+                await asyncio.sleep(wait if wait > 0 else 0.01)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        return self._observe_wait(started, label)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        请求完成后用实际 token 用量修正预估值，多退少补
+        """
+        if not self.token_bucket:
+            return
+        with self._cond:
+            self.token_bucket.consume(actual_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+    def _observe_wait(self, started: float, label: Optional[str]) -> float:
+        waited = time.monotonic() - started
+        self.metrics.observe("llm_rate_limit_wait_seconds", waited, agent=label)
+        return waited
+
+    def _estimate_request_tokens(self, content: bytes) -> int:
+        try:
+            body = json.loads(content or b"{}")
+        except ValueError:
+            return 0
+        completion_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 512
+        return estimate_tokens(body.get("messages") or [], completion_tokens=completion_tokens)
+
+    def httpx_event_hooks(self, label: str = None) -> Dict[str, list]:
+        """
+        供 httpx.Client(event_hooks=...) 使用的钩子，让基于 OpenAI SDK 的第三方封装也共享同一限流器
+        """
+        def _on_request(request) -> None:
+            self.acquire(self._estimate_request_tokens(request.content), label=label)
+        return {"request": [_on_request]}
+
+    def async_httpx_event_hooks(self, label: str = None) -> Dict[str, list]:
+        """
+        供 httpx.AsyncClient(event_hooks=...) 使用的钩子，
+        例如 AgentScope 的 OpenAIChatModel(client_args={"http_client": ...})
+        或 AutoGen 的 OpenAIChatCompletionClient(http_client=...)
+        """
+        async def _on_request(request) -> None:
+            await self.aacquire(self._estimate_request_tokens(request.content), label=label)
+        return {"request": [_on_request]}
+
+
+_shared_limiter: Optional[RateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_limiter() -> Optional[RateLimiter]:
+    """
+    获取进程内共享的限流器；首次调用时按 LLM_RPM / LLM_TPM 环境变量创建，都未配置时返回 None
+    """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            rpm = os.getenv("LLM_RPM")
+            tpm = os.getenv("LLM_TPM")
+            if rpm or tpm:
+                _shared_limiter = RateLimiter(
+                    rpm=float(rpm) if rpm else None,
+                    tpm=float(tpm) if tpm else None
+                )
+        return _shared_limiter
+
+
+def set_shared_limiter(limiter: Optional[RateLimiter]) -> None:
+    """
+    替换进程内共享的限流器；传入 None 会清空，下次获取时重新按环境变量创建
+    """
+    global _shared_limiter
+    with _shared_lock:
+        _shared_limiter = limiter
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    limiter = RateLimiter(rpm=120, tpm=6000)
+    messages = [{"role": "user", "content": "帮我查询今天广州的天气"}]
+    # 桶初始是满的：前 120 个请求立即放行，之后每 0.5 秒放行一个
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        waits = list(pool.map(lambda _: limiter.acquire(estimate_tokens(messages, 20)), range(130)))
+    print(f"最长排队 {max(waits):.2f}s")
+    print(limiter.metrics.histogram("llm_rate_limit_wait_seconds").summary())
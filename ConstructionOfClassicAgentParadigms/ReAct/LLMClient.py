@@ -1,5 +1,5 @@
 import os
-from typing import Dict, List
+from typing import Any, Dict, List
 from openai import OpenAI
 
 
@@ -23,14 +23,24 @@ class LLMClient:
             base_url=self.baseUrl,
             timeout=self.timeout
         )
+        # 累计调用次数与 token 用量，便于比较不同调用方式的开销
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def _record_usage(self, usage) -> None:
+        self.usage["calls"] += 1
+        if usage is not None:
+            self.usage["prompt_tokens"] += usage.prompt_tokens or 0
+            self.usage["completion_tokens"] += usage.completion_tokens or 0
 
     def generate(self,
                  message: List[Dict[str, str]],
                  temperature: float = 0,
-                 stream: bool = True
+                 stream: bool = True,
+                 stop: List[str] = None
                  ) -> str:
         """
         调用大模型，生成回答
+        :param stop: 停止序列，模型生成到其中任意一个时结束（停止序列本身不会出现在结果中）
         """
         print(f"================ 🧠 正在调用 {self.model} 模型 ================")
         try:
@@ -38,22 +48,60 @@ class LLMClient:
                 model=self.model,
                 messages=message,
                 temperature=temperature,
-                stream=stream
+                stream=stream,
+                **({"stop": stop} if stop else {}),
+                **({"stream_options": {"include_usage": True}} if stream else {})
             )
 
             print("✅ 大语言模型响应成功:")
+            if not stream:
+                self._record_usage(response.usage)
+                content = response.choices[0].message.content or ""
+                print(content)
+                return content
+
             collected_content = []
+            usage = None
             for chunk in response:
+                # 开启 include_usage 后，最后一个分片只携带用量，choices 为空
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
                 content = chunk.choices[0].delta.content or ""
                 print(content, end="", flush=True)
                 collected_content.append(content)
             # 输出结束后换行
             print()
+            self._record_usage(usage)
             return "".join(collected_content)
         except Exception as e:
             print(f"❌ 调用大模型失败: {e}")
             return None
 
+    def chat(self,
+             message: List[Dict[str, Any]],
+             tools: List[Dict[str, Any]] = None,
+             temperature: float = 0):
+        """
+        非流式调用大模型，支持原生工具调用（function calling）
+        :param tools: OpenAI 格式的工具定义列表
+        :return: 模型返回的 assistant 消息（可能包含 tool_calls），调用失败时返回 None
+        """
+        print(f"================ 🧠 正在调用 {self.model} 模型（工具数 {len(tools or [])}） ================")
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=message,
+                temperature=temperature,
+                **({"tools": tools} if tools else {})
+            )
+            self._record_usage(response.usage)
+            return response.choices[0].message
+        except Exception as e:
+            print(f"❌ 调用大模型失败: {e}")
+            return None
+
 
 if __name__ == "__main__":
     try:
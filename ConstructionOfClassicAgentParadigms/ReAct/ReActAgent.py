@@ -1,3 +1,8 @@
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+from LLMClient import LLMClient
 from SearchTool import search
 from ToolExecutor import ToolExecutor
 
@@ -19,14 +24,190 @@ REACT_PROMPT_TEMPLATE = """
     History: {history}
     """
 
+# 模型应在输出 Action 后停下，由本地执行工具并填入 Observation
+REACT_STOP_SEQUENCES = ["Observation:"]
+
+TOOLS_SYSTEM_PROMPT = """
+    你是一个智能助手，可以借助提供的工具完成用户提出的任务或需求。
+    需要查询信息时直接调用工具，多个互不依赖的查询可以在同一轮中同时调用；
+    收集到足够的信息后，直接回复最终答案，不要再调用工具。
+    """
+
 
 class ReActAgent:
     """
     ReActAgent: 基于ReAct范式的智能助手
+
+    支持两种模式：
+    - text：按 REACT_PROMPT_TEMPLATE 的 Thought / Action `tool[input]` 文本协议交互，由本地解析 Action
+    - tools：使用模型原生的工具调用（function calling），工具定义由 ToolExecutor 注册信息生成，
+      不存在文本解析失败，模型也可以在一轮中同时发起多个工具调用
     """
-    
-        
+    TEXT = "text"
+    TOOLS = "tools"
+
+    def __init__(self, llm_client: LLMClient, tool_executor: ToolExecutor, mode: str = TEXT, max_steps: int = 5):
+        if mode not in (self.TEXT, self.TOOLS):
+            raise ValueError(f"未知的模式: {mode}")
+        self.llm_client = llm_client
+        self.tool_executor = tool_executor
+        self.mode = mode
+        self.max_steps = max_steps
+        # 最近一次运行的统计
+        self.stats: Dict[str, int] = {}
+
+    def run(self, question: str) -> str:
+        """
+        运行智能体，返回最终答案；超过最大步数或调用失败时返回 None
+        """
+        print(f"\n--------- 开始处理问题（{self.mode} 模式） --------- \n {question}")
+        usage_before = dict(self.llm_client.usage)
+        self.stats = {"steps": 0, "tool_calls": 0, "parse_failures": 0}
+
+        answer = self._run_text(question) if self.mode == self.TEXT else self._run_tools(question)
+
+        for key, value in self.llm_client.usage.items():
+            self.stats[key] = value - usage_before.get(key, 0)
+        print(f"最终结果：\n{answer}")
+        print(f"📊 {self.stats}")
+        return answer
+
+    def _run_text(self, question: str):
+        history = []
+        for _ in range(self.max_steps):
+            self.stats["steps"] += 1
+            prompt = REACT_PROMPT_TEMPLATE.format(
+                available_tools=self.tool_executor.getAvailableTools(),
+                question=question,
+                history="\n".join(history) or "无"
+            )
+            response_text = self.llm_client.generate([{"role": "user", "content": prompt}], stop=REACT_STOP_SEQUENCES)
+            if response_text is None:
+                return None
+
+            thought, action = self._parse_output(response_text)
+            if action is None:
+                self.stats["parse_failures"] += 1
+                history.append("Observation: 未能解析出 Action，请严格按照 Thought / Action 的格式回答。")
+                continue
+            history.append(f"Thought: {thought}\nAction: {action}")
+
+            tool_name, tool_input = self._parse_action(action)
+            if tool_name is None:
+                self.stats["parse_failures"] += 1
+                history.append(f"Observation: 无法解析的 Action「{action}」，格式应为 tool_name[tool_input]。")
+                continue
+            if tool_name == "Finish":
+                return tool_input
+
+            self.stats["tool_calls"] += 1
+            history.append(f"Observation: {self._call_tool(tool_name, tool_input)}")
+
+        print("❌ 超过最大步数仍未得到最终答案")
+        return None
+
+    def _run_tools(self, question: str):
+        messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": TOOLS_SYSTEM_PROMPT},
+            {"role": "user", "content": question}
+        ]
+        schemas = self.tool_executor.getToolSchemas()
+        for _ in range(self.max_steps):
+            self.stats["steps"] += 1
+            message = self.llm_client.chat(messages, tools=schemas)
+            if message is None:
+                return None
+            if not message.tool_calls:
+                return message.content
+
+            messages.append({
+                "role": "assistant",
+                "content": message.content or "",
+                "tool_calls": [call.model_dump() for call in message.tool_calls]
+            })
+            # 同一轮中的多个工具调用并发执行，超时或出错的调用以错误信息作为观察结果
+            self.stats["tool_calls"] += len(message.tool_calls)
+            results = self.tool_executor.execute_many([self._native_call(call) for call in message.tool_calls])
+            for call, result in zip(message.tool_calls, results):
+                print(f"🔧 {result}")
+                messages.append({"role": "tool", "tool_call_id": call.id, "content": result.to_observation()})
+
+        print("❌ 超过最大步数仍未得到最终答案")
+        return None
+
+    @staticmethod
+    def _parse_output(text: str) -> Tuple[str, str]:
+        thought = re.search(r"Thought:\s*(.*?)(?=\nAction:|$)", text, re.DOTALL)
+        # 只取第一个 Action，到下一行的 Observation / Thought / Action 为止，忽略模型自行续写的后续轮次
+        action = re.search(r"Action:\s*(.*?)(?=\n\s*(?:Observation|Thought|Action):|$)", text, re.DOTALL)
+        return (thought.group(1).strip() if thought else ""), (action.group(1).strip().strip("`") if action else None)
+
+    @staticmethod
+    def _parse_action(action: str) -> Tuple[str, str]:
+        # 工具输入到第一个 ] 为止
+        match = re.match(r"(\w+)\[(.*?)\]", action, re.DOTALL)
+        if not match:
+            return None, None
+        return match.group(1), match.group(2).strip()
+
+    def _call_tool(self, tool_name: str, tool_input: str) -> str:
+        result = self.tool_executor.execute(tool_name, tool_input)
+        print(f"🔧 {result}")
+        return result.to_observation()
+
+    @staticmethod
+    def _native_call(call) -> Tuple[str, Any]:
+        try:
+            arguments = json.loads(call.function.arguments or "{}")
+        except json.JSONDecodeError:
+            # 参数不是合法 JSON 时原样作为唯一参数传入
+            arguments = call.function.arguments
+        return call.function.name, arguments
+
+
+def benchmark(llm_client: LLMClient,
+              tool_executor: ToolExecutor,
+              tasks: List[Tuple[str, str]],
+              modes: Tuple[str, ...] = (ReActAgent.TEXT, ReActAgent.TOOLS)) -> Dict[str, Dict[str, float]]:
+    """
+    对比两种模式在同一批任务上的开销
+    :param tasks: [(问题, 期望答案中包含的关键词)]，关键词为空时只要给出答案即视为解决
+    :return: 每种模式的解决数，以及每个已解决任务平均的 LLM 调用次数与 token 数
+    """
+    report = {}
+    for mode in modes:
+        agent = ReActAgent(llm_client, tool_executor, mode=mode)
+        totals = {"solved": 0, "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "parse_failures": 0}
+        for question, expected in tasks:
+            answer = agent.run(question)
+            if answer and (not expected or expected in answer):
+                totals["solved"] += 1
+            for key in ("calls", "prompt_tokens", "completion_tokens", "parse_failures"):
+                totals[key] += agent.stats.get(key, 0)
+        solved = totals["solved"] or 1
+        report[mode] = {
+            "solved": totals["solved"],
+            "tasks": len(tasks),
+            "calls_per_solved": totals["calls"] / solved,
+            "tokens_per_solved": (totals["prompt_tokens"] + totals["completion_tokens"]) / solved,
+            "parse_failures": totals["parse_failures"],
+        }
+
+    print("\n====================== 模式对比 ======================")
+    for mode, row in report.items():
+        print(f"{mode:>5}: 解决 {row['solved']}/{row['tasks']}，每个已解决任务 "
+              f"{row['calls_per_solved']:.1f} 次调用、{row['tokens_per_solved']:.0f} tokens，"
+              f"解析失败 {row['parse_failures']} 次")
+    return report
 
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    llm_client = LLMClient(model="deepseek-chat")
+    tool_executor = ToolExecutor()
+    tool_executor.register_tool("search", "网页搜索引擎，输入搜索关键词，返回搜索结果摘要", search,
+                                timeout=15, max_concurrency=4)
+
+    benchmark(llm_client, tool_executor, [
+        ("英伟达最新的 GPU 型号是什么？", ""),
+        ("分别查询北京和上海今天的天气，哪个城市更适合户外活动？", ""),
+    ])
@@ -1,27 +1,289 @@
-from typing import Any, Dict
+import asyncio
+import inspect
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple, Union
 from SearchTool import search
 
 
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", list: "array", dict: "object"}
+
+
+def infer_parameters(tool_func: callable) -> Dict[str, Any]:
+    """
+    根据函数签名推断 JSON Schema 形式的参数定义：按类型注解映射 JSON 类型（无注解视为字符串），
+    没有默认值的参数为必填
+    """
+    properties = {}
+    required = []
+    for name, param in inspect.signature(tool_func).parameters.items():
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        annotation = param.annotation if param.annotation is not inspect.Parameter.empty else str
+        properties[name] = {"type": _JSON_TYPES.get(annotation, "string")}
+        if param.default is inspect.Parameter.empty:
+            required.append(name)
+    return {"type": "object", "properties": properties, "required": required}
+
+
+class ToolResult:
+    """
+    一次工具调用的结构化结果
+    """
+    def __init__(self, tool_name: str, output: Any = None, error: str = None, timed_out: bool = False, latency: float = 0.0):
+        self.tool_name = tool_name
+        self.output = output
+        self.error = error
+        self.timed_out = timed_out
+        # 从发起调用到拿到结果的耗时（秒），包含排队等待
+        self.latency = latency
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_observation(self) -> str:
+        """
+        转换为回填给模型的观察文本
+        """
+        if self.ok:
+            return str(self.output)
+        return f"❌ 工具 {self.tool_name} {self.error}"
+
+    def __repr__(self):
+        status = "ok" if self.ok else self.error
+        return f"ToolResult({self.tool_name}, {status}, latency={self.latency:.3f}s)"
+
+
 class ToolExecutor:
     """
     工具执行器, 用于执行工具函数
+
+    execute / aexecute 在有界线程池中运行同步工具、在事件循环中直接运行异步工具，
+    支持每个工具的超时与并发上限，结果以 ToolResult 返回，不会抛出工具内部的异常。
+    同步工具达到并发上限时，后续调用在该工具自己的队列中等待，不占用线程池的工作线程，
+    因此一个工具排满不会挡住其他工具。
+    线程无法被强制终止：同步工具超时后调用方立即返回，还没开始执行的调用会被取消，
+    已经在执行的会在后台跑完，期间仍占用该工具的并发名额。
     """
-    def __init__(self):
+    def __init__(self, max_workers: int = 8, default_timeout: float = 30.0):
         self.tools: Dict[str, Dict[str, Any]] = {}
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        # 保护各工具的并发计数与等待队列
+        self._lock = threading.Lock()
 
-    def register_tool(self, tool_name: str, tool_desc: str, tool_func: callable) -> None:
+    def register_tool(self,
+                      tool_name: str,
+                      tool_desc: str,
+                      tool_func: callable,
+                      parameters: Dict[str, Any] = None,
+                      timeout: float = None,
+                      max_concurrency: int = None) -> None:
         """
         向工具箱中注册一个新工具。
+        :param parameters: JSON Schema 形式的参数定义，用于原生工具调用；未提供时根据函数签名推断
+        :param timeout: 该工具的超时（秒），未设置时使用 default_timeout
+        :param max_concurrency: 该工具同时执行的调用数上限，未设置时不限制（仍受线程池大小约束）
         """
         if tool_name in self.tools:
             print(f"⚠️ 工具 {tool_name} 已存在，直接替换。")
         self.tools[tool_name] = {
             "desc": tool_desc,
-            "func": tool_func
+            "func": tool_func,
+            "parameters": parameters or infer_parameters(tool_func),
+            "timeout": timeout,
+            "max_concurrency": max_concurrency,
+            # 已提交到线程池（执行中或在线程池中排队）的同步调用数，以及超出上限后等待的调用
+            "running": 0,
+            "waiting": deque(),
+            # 异步工具的并发计数与等待者；等待者记录所属的事件循环，不依赖绑定到某个循环的 Semaphore
+            "async_running": 0,
+            "async_waiters": deque()
         }
         print(f"工具 '{tool_name}' 已注册。")
-    
 
+    def execute(self, tool_name: str, arguments: Union[Dict[str, Any], str, None] = None, timeout: float = None) -> ToolResult:
+        """
+        同步执行工具，最多等待 timeout 秒
+        :param arguments: 字典按关键字参数传入，字符串作为唯一的位置参数传入
+        """
+        started = time.perf_counter()
+        tool = self.tools.get(tool_name)
+        if tool is None:
+            return ToolResult(tool_name, error="不存在")
+        timeout = self._timeout(tool, timeout)
+
+        abandoned = threading.Event()
+        try:
+            future = self._submit(tool, arguments, abandoned)
+            output = future.result(timeout=timeout)
+            return ToolResult(tool_name, output=output, latency=time.perf_counter() - started)
+        except FutureTimeoutError:
+            abandoned.set()
+            future.cancel()
+            return ToolResult(tool_name, error=f"执行超时（{timeout}s）", timed_out=True, latency=time.perf_counter() - started)
+        except Exception as e:
+            return ToolResult(tool_name, error=f"执行失败: {e}", latency=time.perf_counter() - started)
+
+    async def aexecute(self,
+                       tool_name: str,
+                       arguments: Union[Dict[str, Any], str, None] = None,
+                       timeout: float = None) -> ToolResult:
+        """
+        异步执行工具：异步工具直接在当前事件循环中运行，同步工具交给线程池；
+        取消该协程会同时取消异步工具，以及尚未开始执行的同步工具
+        """
+        started = time.perf_counter()
+        tool = self.tools.get(tool_name)
+        if tool is None:
+            return ToolResult(tool_name, error="不存在")
+        timeout = self._timeout(tool, timeout)
+
+        abandoned = threading.Event()
+        try:
+            if inspect.iscoroutinefunction(tool["func"]):
+                output = await asyncio.wait_for(self._run_async(tool, arguments), timeout)
+            else:
+                future = asyncio.wrap_future(self._submit(tool, arguments, abandoned))
+                output = await asyncio.wait_for(future, timeout)
+            return ToolResult(tool_name, output=output, latency=time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            abandoned.set()
+            return ToolResult(tool_name, error=f"执行超时（{timeout}s）", timed_out=True, latency=time.perf_counter() - started)
+        except asyncio.CancelledError:
+            abandoned.set()
+            raise
+        except Exception as e:
+            return ToolResult(tool_name, error=f"执行失败: {e}", latency=time.perf_counter() - started)
+
+    def execute_many(self, calls: List[Tuple[str, Union[Dict[str, Any], str, None]]]) -> List[ToolResult]:
+        """
+        并发执行多个工具调用，结果与输入顺序一致
+        """
+        async def _run():
+            return await asyncio.gather(*(self.aexecute(name, arguments) for name, arguments in calls))
+
+        return asyncio.run(_run())
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            for tool in self.tools.values():
+                while tool["waiting"]:
+                    tool["waiting"].popleft()[0].cancel()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _timeout(self, tool: Dict[str, Any], timeout: Optional[float]) -> float:
+        if timeout is not None:
+            return timeout
+        return tool["timeout"] if tool["timeout"] is not None else self.default_timeout
+
+    @staticmethod
+    def _call(func: callable, arguments: Union[Dict[str, Any], str, None]):
+        if isinstance(arguments, dict):
+            return func(**arguments)
+        if arguments is None:
+            return func()
+        return func(arguments)
+
+    def _submit(self, tool: Dict[str, Any], arguments, abandoned: threading.Event) -> Future:
+        """
+        提交一次同步调用：未达到该工具的并发上限时交给线程池，否则进入该工具的等待队列
+        """
+        future = Future()
+        item = (future, arguments, abandoned)
+        with self._lock:
+            if tool["max_concurrency"] and tool["running"] >= tool["max_concurrency"]:
+                tool["waiting"].append(item)
+                return future
+            tool["running"] += 1
+        try:
+            self._pool.submit(self._drain, tool, item)
+        except Exception:
+            with self._lock:
+                tool["running"] -= 1
+            raise
+        return future
+
+    def _drain(self, tool: Dict[str, Any], item) -> None:
+        """
+        在工作线程中执行一次调用，结束后接着执行该工具队列中等待的调用，队列为空时归还名额
+        """
+        while item is not None:
+            future, arguments, abandoned = item
+            # 排队期间调用方已超时或取消，不再执行
+            if future.set_running_or_notify_cancel() and not abandoned.is_set():
+                try:
+                    future.set_result(self._run_sync(tool, arguments))
+                except BaseException as e:
+                    future.set_exception(e)
+            elif not future.done():
+                future.set_result(None)
+            with self._lock:
+                item = tool["waiting"].popleft() if tool["waiting"] else None
+                if item is None:
+                    tool["running"] -= 1
+
+    def _run_sync(self, tool: Dict[str, Any], arguments):
+        result = self._call(tool["func"], arguments)
+        if inspect.isawaitable(result):
+            # 同步入口调用异步工具时，在工作线程中运行它
+            result = asyncio.run(result)
+        return result
+
+    async def _run_async(self, tool: Dict[str, Any], arguments):
+        if not tool["max_concurrency"]:
+            return await self._call(tool["func"], arguments)
+        await self._acquire_async(tool)
+        try:
+            return await self._call(tool["func"], arguments)
+        finally:
+            self._release_async(tool)
+
+    async def _acquire_async(self, tool: Dict[str, Any]) -> None:
+        """
+        获取异步工具的并发名额，名额已满时排队等待；释放时名额直接转交给队首的等待者
+        """
+        with self._lock:
+            if tool["async_running"] < tool["max_concurrency"]:
+                tool["async_running"] += 1
+                return
+            waiter = {"loop": asyncio.get_running_loop(), "future": None, "granted": False}
+            waiter["future"] = waiter["loop"].create_future()
+            tool["async_waiters"].append(waiter)
+        try:
+            await waiter["future"]
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter["granted"]
+                if not granted:
+                    tool["async_waiters"].remove(waiter)
+            # 取消时名额已经转交过来，继续交给下一个等待者
+            if granted:
+                self._release_async(tool)
+            raise
+
+    def _release_async(self, tool: Dict[str, Any]) -> None:
+        with self._lock:
+            while tool["async_waiters"]:
+                waiter = tool["async_waiters"].popleft()
+                waiter["granted"] = True
+                try:
+                    waiter["loop"].call_soon_threadsafe(self._wake, waiter["future"])
+                    return
+                except RuntimeError:
+                    # 等待者所在的事件循环已关闭
+                    continue
+            tool["async_running"] -= 1
+
+    @staticmethod
+    def _wake(future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+    def getToolNames(self) -> List[str]:
         """
         获取工具列表
         """
@@ -42,10 +304,23 @@ class ToolExecutor:
             for name, info in self.tools.items()
         ])
 
+    def getToolSchemas(self) -> List[Dict[str, Any]]:
+        """
+        获取 OpenAI tools（function calling）格式的工具定义列表。
+        """
+        return [
+            {
+                "type": "function",
+                "function": {"name": name, "description": info["desc"], "parameters": info["parameters"]}
+            }
+            for name, info in self.tools.items()
+        ]
+
 
 if __name__ == "__main__":
     tool_executor = ToolExecutor()
-    tool_executor.register_tool("search", "搜索工具", search)
-    search_tool = tool_executor.getTool("search")
-    print(search_tool("今天广州的天气怎么样"))
-    print(tool_executor.getAvailableTools())
\ No newline at end of file
+    tool_executor.register_tool("search", "搜索工具", search, timeout=10, max_concurrency=2)
+    print(tool_executor.execute("search", {"query": "今天广州的天气怎么样"}))
+    print(tool_executor.execute_many([("search", "北京天气"), ("search", "上海天气"), ("search", "深圳天气")]))
+    print(tool_executor.getAvailableTools())
+    print(tool_executor.getToolSchemas())
\ No newline at end of file
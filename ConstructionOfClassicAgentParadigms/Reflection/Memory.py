@@ -20,17 +20,24 @@ class Memory:
         self.records.append(record)
         print(f"新增一条 {record_type} 记忆")
 
-    def get_trajectory(self) -> str:
+    def get_trajectory(self, context_window=None, skip_last: int = 0) -> str:
         """
         将所有的记忆记录拼接成一个字符串
+
+        Args:
+            context_window: 可选的 ContextWindow，轨迹超出 token 预算时按其策略裁剪较早的记录
+            skip_last: 不包含最后 skip_last 条记录（调用方已单独提供它们时使用）
         """
         trajectory_parts = []
-        for record in self.records:
+        records = self.records[:len(self.records) - skip_last] if skip_last else self.records
+        for record in records:
             if record['type'] == 'execution':
                 trajectory_parts.append(f"--- 上一轮尝试 (代码) ---\n{record['content']}")
             elif record['type'] == 'reflection':
                 trajectory_parts.append(f"--- 评审员反馈 ---\n{record['content']}")
 
+        if context_window is not None:
+            trajectory_parts = context_window.fit_texts(trajectory_parts, label="Memory")
         return "\n\n".join(trajectory_parts)
 
     def get_last_execution(self) -> Optional[str]:
@@ -4,6 +4,7 @@ import os
 # 添加父目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+from ContextWindow import ContextWindow
 from LLMClient import LLMClient
 from Memory import Memory
 
@@ -35,12 +36,18 @@ REFLECTION_PROMPT_TEMPLATE = """
     请直接输出你的反馈，不要包含任何额外的解释。
     """
 
+# 配置了上下文窗口时插入优化提示词的更早轨迹
+HISTORY_SECTION_TEMPLATE = """
+    # 更早的尝试与评审反馈：
+    {trajectory}
+"""
+
 REFINE_PROMPT_TEMPLATE = """
     你是一位资深的 Python 专家。你正在根据一位代码审查专家的反馈来优化你的代码。
 
     # 原始任务：
     {task}
-
+{history}
     # 你上一轮尝试的代码：
     ```python
     {last_code_attempt}
@@ -56,10 +63,13 @@ REFINE_PROMPT_TEMPLATE = """
 
 class ReflectionAgent:
 
-    def __init__(self, llm_client: LLMClient, max_iterations: int = 3):
+    def __init__(self, llm_client: LLMClient, max_iterations: int = 3, context_window: ContextWindow = None):
         self.llm_client = llm_client
         self.max_iterations = max_iterations
         self.memory = Memory()
+        # 可选的上下文窗口：配置后优化提示词会携带更早的尝试与反馈，并按其 token 预算裁剪；
+        # 未配置时提示词只包含上一轮代码与本轮反馈，大小不随迭代增长
+        self.context_window = context_window
 
     def run(self, task: str):
         print(f"🔍 开始执行任务: {task}")
@@ -92,8 +102,14 @@ class ReflectionAgent:
 
             # c.优化
             print("\n-> 正在进行优化...")
+            history = ""
+            if self.context_window is not None:
+                # 上一轮代码与本轮反馈单独给出，历史中只包含更早的记录
+                trajectory = self.memory.get_trajectory(context_window=self.context_window, skip_last=2)
+                history = HISTORY_SECTION_TEMPLATE.format(trajectory=trajectory or "无")
             refine_prompt = REFINE_PROMPT_TEMPLATE.format(
                 task=task,
+                history=history,
                 last_code_attempt=last_code_attempt,
                 reviewer_feedback=reflection_feedback,
             )
@@ -109,10 +125,11 @@ class ReflectionAgent:
         """
         messages = [{"role": "user", "content": prompt}]
 
-        return self.llm_client.generate(messages, stream=True) or ""
+        return self.llm_client.generate(messages, stream=True, label="ReflectionAgent") or ""
 
 
 if __name__ == "__main__":
     llm_client = LLMClient(model="deepseek-chat")
-    reflection_agent = ReflectionAgent(llm_client=llm_client)
+    reflection_agent = ReflectionAgent(llm_client=llm_client, context_window=ContextWindow(max_tokens=4000))
     reflection_agent.run(task="编写一个排序算法")
+    print(llm_client.metrics.to_json())
@@ -0,0 +1,330 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable
+
+import httpx
+import openai
+
+from Metrics import Histogram
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断器处于打开状态，请求被直接拒绝
+    """
+
+
+class RetryPolicy:
+    """
+    重试策略：对可重试错误做带抖动的指数退避
+
+    第 n 次重试前等待 uniform(0, min(max_delay, base_delay * 2^n)) 秒（full jitter）
+    """
+    RETRYABLE_STATUS = {408, 409, 429}
+
+    def __init__(self, max_retries: int = 2, base_delay: float = 0.5, max_delay: float = 8.0, jitter: bool = True):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """
+        网络错误、超时、限流和 5xx 视为可重试
+        """
+        if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code >= 500 or error.status_code in self.RETRYABLE_STATUS
+        return False
+
+    def delay(self, attempt: int) -> float:
+        backoff = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(0, backoff) if self.jitter else backoff
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 failure_threshold 次后打开，在 recovery_timeout 秒内快速失败；
+    之后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """
+        请求前检查，熔断时抛出 CircuitOpenError
+        :return: 本次请求是否为半开状态下的探测请求，探测请求结束时必须调用 release_probe
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    raise CircuitOpenError("熔断器已打开，服务暂不可用")
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError("熔断器半开，正在等待探测请求结果")
+                self._probing = True
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """
+        探测请求既没有记为成功也没有记为失败就结束（如被取消）时视为失败，重新打开熔断器，
+        避免半开状态一直等待一个不会返回的探测结果
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probing:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class HedgePolicy:
+    """
+    对冲请求策略：首个请求超过对冲延迟仍未返回时，再发出一个相同请求，取先完成者
+
+    未指定固定 delay 时，按历史延迟的 percentile 分位数计算；样本不足 min_samples 时使用 fallback_delay
+    """
+    def __init__(self,
+                 delay: float = None,
+                 percentile: float = 95,
+                 min_samples: int = 20,
+                 fallback_delay: float = 2.0):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.fallback_delay = fallback_delay
+
+    def hedge_delay(self, histogram: Histogram) -> float:
+        if self.delay is not None:
+            return self.delay
+        if histogram.count < self.min_samples:
+            return self.fallback_delay
+        return histogram.percentile(self.percentile)
+
+
+def call_with_retry(fn: Callable[[], Any],
+                    policy: RetryPolicy,
+                    breaker: CircuitBreaker = None,
+                    on_retry: Callable[[int, BaseException, float], None] = None) -> Any:
+    """
+    按重试策略与熔断器执行 fn
+    """
+    attempt = 0
+    while True:
+        probe = breaker.before_call() if breaker is not None else False
+        try:
+            result = fn()
+        except Exception as e:
+            retryable = policy.is_retryable(e)
+            if breaker is not None:
+                # 不可重试的错误（如 400）说明服务端能正常响应，同样视为服务可用
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if not retryable or attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt)
+            if on_retry:
+                on_retry(attempt + 1, e, delay)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+        finally:
+            # 被取消或中断的探测请求按失败处理，释放探测名额
+            if probe:
+                breaker.release_probe()
+
+
+async def acall_with_retry(fn: Callable[[], Awaitable[Any]],
+                           policy: RetryPolicy,
+                           breaker: CircuitBreaker = None,
+                           on_retry: Callable[[int, BaseException, float], None] = None) -> Any:
+    """
+    call_with_retry 的异步版本
+    """
+    attempt = 0
+    while True:
+        probe = breaker.before_call() if breaker is not None else False
+        try:
+            result = await fn()
+        except Exception as e:
+            retryable = policy.is_retryable(e)
+            if breaker is not None:
+                # 不可重试的错误（如 400）说明服务端能正常响应，同样视为服务可用
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if not retryable or attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt)
+            if on_retry:
+                on_retry(attempt + 1, e, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+        finally:
+            # 被取消或中断的探测请求按失败处理，释放探测名额
+            if probe:
+                breaker.release_probe()
+
+
+def hedged_call(fn: Callable[[], Any],
+                delay: float,
+                executor: Executor,
+                discard: Callable[[Any], None] = None,
+                on_hedge: Callable[[], None] = None) -> Any:
+    """
+    对冲执行 fn：delay 秒内未完成则在线程池中再发起一次，返回先成功的结果
+
+    落败请求的结果会交给 discard 释放（如关闭流式连接）
+    """
+    def _discard_later(future: Future) -> None:
+        if discard is not None and not future.cancelled() and future.exception() is None:
+            discard(future.result())
+
+    first = executor.submit(fn)
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+
+    if on_hedge:
+        on_hedge()
+    pending = {first, executor.submit(fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winners = [future for future in done if future.exception() is None]
+        if winners:
+            for future in list(pending) + winners[1:]:
+                future.add_done_callback(_discard_later)
+            return winners[0].result()
+        error = next(iter(done)).exception()
+    raise error
+
+
+async def ahedged_call(fn: Callable[[], Awaitable[Any]],
+                       delay: float,
+                       discard: Callable[[Any], Awaitable[None]] = None,
+                       on_hedge: Callable[[], None] = None) -> Any:
+    """
+    hedged_call 的异步版本，落败的请求会被直接取消
+    """
+    first = asyncio.ensure_future(fn())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    if on_hedge:
+        on_hedge()
+    pending = {first, asyncio.ensure_future(fn())}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        winners = [task for task in done if task.exception() is None]
+        if winners:
+            for task in pending:
+                task.cancel()
+            for task in winners[1:]:
+                if discard is not None:
+                    await discard(task.result())
+            return winners[0].result()
+        error = next(iter(done)).exception()
+    raise error
+
+
+if __name__ == "__main__":
+    # 用一个会注入延迟和 5xx 错误的本地假服务演示重试、对冲与熔断
+    import json
+    import sys
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from LLMClient import LLMClient
+
+    class FlakyHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if random.random() < self.server.error_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+            time.sleep(random.choice([0.05] * 9 + [1.5]))
+            payload = json.dumps({
+                "id": "fake", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "pong"}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    server.error_rate = 0.1
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    client = LLMClient(
+        model="fake-model", apiKey="fake", baseUrl=base_url, quiet=True,
+        retry=RetryPolicy(max_retries=3, base_delay=0.05),
+        hedge=HedgePolicy(delay=0.3),
+        circuit_breaker=CircuitBreaker(failure_threshold=5, recovery_timeout=1.0),
+    )
+    messages = [{"role": "user", "content": "ping"}]
+    results = [client.generate(messages) for _ in range(30)]
+    print(f"成功 {sum(r is not None for r in results)}/30")
+
+    print("\n--- 服务不可用时熔断 ---")
+    server.error_rate = 1.0
+    for i in range(6):
+        start = time.perf_counter()
+        client.generate(messages)
+        print(f"第 {i + 1} 次: 熔断器={client.circuit_breaker.state}, 耗时 {time.perf_counter() - start:.3f}s")
+    server.shutdown()
+
+    json.dump(client.metrics.snapshot()["counters"], sys.stdout, ensure_ascii=False, indent=2)
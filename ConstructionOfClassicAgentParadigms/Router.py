@@ -0,0 +1,243 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class Endpoint:
+    """
+    一个 OpenAI 兼容服务端点
+
+    Args:
+        base_url: 服务地址
+        api_key: API 密钥
+        name: 端点名称，默认取 base_url
+        weight: 权重，越大越容易被选中
+        model: 该端点上的模型名，不同服务商对同一模型命名不同时使用，默认沿用 LLMClient 的 model
+    """
+    def __init__(self, base_url: str, api_key: str, name: str = None, weight: float = 1.0, model: str = None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.name = name or base_url
+        self.weight = weight
+        self.model = model
+
+        # 运行时统计
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.last_failure_at = 0.0
+        self.inflight = 0
+        self.healthy = True
+        self.unhealthy_until = 0.0
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.name})"
+
+
+class EndpointRouter:
+    """
+    多端点路由器：按 EWMA 延迟、错误率、权重与在途请求数选择端点，失败时自动切换
+
+    得分 = ewma_latency * (1 + error_penalty * error_rate) * (1 + inflight) / weight，越低越好，
+    其中 error_rate 按距上次失败的时间以 error_half_life 为半衰期衰减；
+    尚无延迟样本且未出错的端点优先被选中以完成探测；没有样本但出过错的端点以其他端点的平均延迟作为先验计分。
+    连续失败 max_consecutive_failures 次的端点会被摘除 cooldown 秒，之后重新参与选择。
+    """
+    def __init__(self,
+                 endpoints: List[Endpoint],
+                 alpha: float = 0.3,
+                 error_penalty: float = 5.0,
+                 max_consecutive_failures: int = 3,
+                 cooldown: float = 30.0,
+                 error_half_life: float = 30.0):
+        if not endpoints:
+            raise ValueError("至少需要一个端点")
+        self.endpoints = endpoints
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.max_consecutive_failures = max_consecutive_failures
+        self.cooldown = cooldown
+        self.error_half_life = error_half_life
+        self._lock = threading.Lock()
+        self._health_thread: threading.Thread = None
+        self._stop_health = threading.Event()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> Optional["EndpointRouter"]:
+        """
+        从环境变量构建路由器，未配置时返回 None
+
+        OPENAI_API_BASE_URLS: 逗号分隔的服务地址，可写成 `url|权重|模型名`
+        OPENAI_API_KEYS: 逗号分隔的密钥，与地址一一对应；缺省时所有端点共用 OPENAI_API_KEY
+        """
+        urls = [u.strip() for u in os.getenv("OPENAI_API_BASE_URLS", "").split(",") if u.strip()]
+        if not urls:
+            return None
+        keys = [k.strip() for k in os.getenv("OPENAI_API_KEYS", "").split(",") if k.strip()]
+        endpoints = []
+        for i, spec in enumerate(urls):
+            parts = spec.split("|")
+            api_key = keys[i] if i < len(keys) else os.getenv("OPENAI_API_KEY")
+            endpoints.append(Endpoint(
+                base_url=parts[0],
+                api_key=api_key,
+                weight=float(parts[1]) if len(parts) > 1 and parts[1] else 1.0,
+                model=parts[2] if len(parts) > 2 and parts[2] else None
+            ))
+        return cls(endpoints, **kwargs)
+
+    def _prior_latency(self) -> float:
+        """
+        尚无延迟样本的端点的先验延迟：取其他端点 EWMA 延迟的均值，都没有样本时取 1 秒
+        """
+        measured = [e.ewma_latency for e in self.endpoints if e.ewma_latency is not None]
+        return sum(measured) / len(measured) if measured else 1.0
+
+    def _score(self, endpoint: Endpoint) -> float:
+        if endpoint.ewma_latency is None and endpoint.error_rate == 0:
+            return 0.0
+        # 首次调用就失败的端点没有延迟样本，按先验延迟加错误惩罚计分，仍有机会被重新选中
+        latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else self._prior_latency()
+        return (latency
+                * (1 + self.error_penalty * self._effective_error_rate(endpoint))
+                * (1 + endpoint.inflight)
+                / endpoint.weight)
+
+    def _effective_error_rate(self, endpoint: Endpoint) -> float:
+        """
+        错误率随距上次失败的时间按半衰期衰减，长时间未被选中的端点也能逐渐恢复参与选择
+        """
+        if not endpoint.error_rate:
+            return 0.0
+        elapsed = time.monotonic() - endpoint.last_failure_at
+        return endpoint.error_rate * 0.5 ** (elapsed / self.error_half_life)
+
+    def select(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """
+        选择当前得分最低的健康端点并计入在途请求；所有端点都不可用时退而选择得分最低的端点
+        """
+        exclude = set(exclude)
+        now = time.monotonic()
+        with self._lock:
+            for endpoint in self.endpoints:
+                if not endpoint.healthy and now >= endpoint.unhealthy_until:
+                    # 冷却结束后清空错误统计，让该端点重新获得一次探测机会
+                    endpoint.healthy = True
+                    endpoint.consecutive_failures = 0
+                    endpoint.error_rate = 0.0
+            candidates = [e for e in self.endpoints if e.healthy and e not in exclude]
+            if not candidates:
+                candidates = [e for e in self.endpoints if e not in exclude] or list(self.endpoints)
+            scores = [self._score(e) for e in candidates]
+            best_score = min(scores)
+            chosen = random.choice([e for e, score in zip(candidates, scores) if score == best_score])
+            chosen.inflight += 1
+            return chosen
+
+    def record_success(self, endpoint: Endpoint, latency: float) -> None:
+        with self._lock:
+            endpoint.inflight = max(0, endpoint.inflight - 1)
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency = self.alpha * latency + (1 - self.alpha) * endpoint.ewma_latency
+            endpoint.error_rate = (1 - self.alpha) * endpoint.error_rate
+            endpoint.consecutive_failures = 0
+            endpoint.healthy = True
+
+    def record_failure(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.inflight = max(0, endpoint.inflight - 1)
+            endpoint.error_rate = self.alpha + (1 - self.alpha) * endpoint.error_rate
+            endpoint.consecutive_failures += 1
+            endpoint.last_failure_at = time.monotonic()
+            if endpoint.consecutive_failures >= self.max_consecutive_failures:
+                self._mark_unhealthy(endpoint)
+
+    def release(self, endpoint: Endpoint) -> None:
+        """
+        请求因非端点原因结束（如参数错误、被取消）时仅释放在途计数
+        """
+        with self._lock:
+            endpoint.inflight = max(0, endpoint.inflight - 1)
+
+    def _mark_unhealthy(self, endpoint: Endpoint) -> None:
+        endpoint.healthy = False
+        endpoint.unhealthy_until = time.monotonic() + self.cooldown
+
+    def health_check(self, probe: Callable[[Endpoint], Any]) -> Dict[str, bool]:
+        """
+        对所有端点执行一次健康检查，probe 抛出异常即视为不健康
+        """
+        results = {}
+        for endpoint in self.endpoints:
+            try:
+                started = time.perf_counter()
+                probe(endpoint)
+                latency = time.perf_counter() - started
+                with self._lock:
+                    # 探测通过说明端点已恢复：清空错误统计，没有延迟样本时用探测耗时作为初始值
+                    endpoint.healthy = True
+                    endpoint.consecutive_failures = 0
+                    endpoint.error_rate = 0.0
+                    if endpoint.ewma_latency is None:
+                        endpoint.ewma_latency = latency
+                results[endpoint.name] = True
+            except Exception:
+                with self._lock:
+                    self._mark_unhealthy(endpoint)
+                results[endpoint.name] = False
+        return results
+
+    def start_health_checks(self, probe: Callable[[Endpoint], Any], interval: float = 30.0) -> None:
+        """
+        启动后台线程定期做健康检查
+        """
+        if self._health_thread is not None:
+            return
+        self._stop_health.clear()
+
+        def _loop():
+            while not self._stop_health.wait(interval):
+                self.health_check(probe)
+
+        self._health_thread = threading.Thread(target=_loop, name="endpoint-health-check", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self) -> None:
+        self._stop_health.set()
+        self._health_thread = None
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        导出各端点的路由统计
+        """
+        with self._lock:
+            return [{
+                "name": e.name,
+                "weight": e.weight,
+                "healthy": e.healthy,
+                "ewma_latency": e.ewma_latency,
+                "error_rate": round(e.error_rate, 4),
+                "inflight": e.inflight,
+                "score": self._score(e),
+            } for e in self.endpoints]
+
+
+if __name__ == "__main__":
+    router = EndpointRouter([
+        Endpoint("https://api.deepseek.com", api_key="key-a", name="deepseek"),
+        Endpoint("https://api.siliconflow.cn/v1", api_key="key-b", name="siliconflow",
+                 weight=2.0, model="deepseek-ai/DeepSeek-V3"),
+    ])
+    simulated_latency = {"deepseek": 0.8, "siliconflow": 1.2}
+    for _ in range(20):
+        endpoint = router.select()
+        if endpoint.name == "siliconflow" and random.random() < 0.3:
+            router.record_failure(endpoint)
+        else:
+            router.record_success(endpoint, simulated_latency[endpoint.name] * random.uniform(0.8, 1.2))
+    for row in router.snapshot():
+        print(row)
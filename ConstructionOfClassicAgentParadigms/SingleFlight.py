@@ -0,0 +1,243 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List
+
+from Metrics import MetricsRegistry, default_registry
+
+
+class _Flight:
+    """
+    一次正在进行中的上游调用，保存已产出的文本块，供所有订阅者回放和继续读取
+    """
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: BaseException = None
+        self.subscribers = 0
+        # 仅同步版本使用：上游迭代器，以及当前是否有订阅者正在向上游取下一块
+        self.iterator: Iterator[str] = None
+        self.pulling = False
+        # 仅异步版本使用
+        self.loop: asyncio.AbstractEventLoop = None
+        self.changed: asyncio.Event = None
+        self.task: asyncio.Task = None
+
+
+class SingleFlight:
+    """
+    合并相同的在途请求：同一个 key 同时只会有一个上游调用，其余调用方共享它的结果
+
+    - do / ado：等待完整结果
+    - stream / astream：流式订阅，后加入的订阅者先回放已生成的内容再继续接收；
+      所有订阅者都提前退出时取消上游调用。
+      同步版本不使用后台线程：读完已有内容的订阅者在自己的线程里向上游取下一块，其余订阅者等待，
+      因此同时进行的流数量只受调用方自身线程数的限制
+    被合并掉的调用次数记录在 llm_coalesced_requests_total 指标中。
+    """
+    def __init__(self, metrics: MetricsRegistry = None):
+        self.metrics = metrics or default_registry
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Dict[str, Any]] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._cond = threading.Condition()
+        # 异步版本的在途调用按 key 记录，只在同一个事件循环内合并
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._aflights: Dict[str, _Flight] = {}
+
+    def _count_coalesced(self, labels: Dict[str, str]) -> None:
+        self.metrics.inc("llm_coalesced_requests_total", **(labels or {}))
+
+    def do(self, key: str, fn: Callable[[], Any], labels: Dict[str, str] = None) -> Any:
+        """
+        执行 fn 并返回结果；若相同 key 的调用正在进行，则等待并共享其结果（或异常）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event(), "result": None, "error": None}
+        if not leader:
+            self._count_coalesced(labels)
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["event"].set()
+
+    def stream(self, key: str, fn: Callable[[], Iterator[str]], labels: Dict[str, str] = None) -> Iterator[str]:
+        """
+        流式订阅 fn 产出的文本块；上游由订阅者在各自的线程中轮流推进，进度跟随消费最快的订阅者
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            with self._cond:
+                flight.subscribers += 1
+        if not leader:
+            self._count_coalesced(labels)
+        return self._subscribe(key, flight, fn)
+
+    def _pull(self, key: str, flight: _Flight, fn: Callable[[], Iterator[str]]) -> None:
+        """
+        在当前订阅者的线程中向上游取下一块，调用前需已将 flight.pulling 置为 True
+        """
+        chunk, finished, error = None, False, None
+        try:
+            if flight.iterator is None:
+                flight.iterator = iter(fn())
+            chunk = next(flight.iterator)
+        except StopIteration:
+            finished = True
+        except BaseException as e:
+            finished, error = True, e
+        if finished:
+            self._close(flight)
+            self._forget(self._flights, key, flight)
+        with self._cond:
+            flight.pulling = False
+            if finished:
+                flight.error = error
+                flight.done = True
+            else:
+                flight.chunks.append(chunk)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _close(flight: _Flight) -> None:
+        if flight.iterator is not None and hasattr(flight.iterator, "close"):
+            flight.iterator.close()
+
+    def _subscribe(self, key: str, flight: _Flight, fn: Callable[[], Iterator[str]]) -> Iterator[str]:
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(flight.chunks) and not flight.done and flight.pulling:
+                        self._cond.wait()
+                    pull = False
+                    if index < len(flight.chunks):
+                        chunk = flight.chunks[index]
+                        index += 1
+                    elif flight.done:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    else:
+                        # 已有内容都读完且没有人在取下一块，由当前订阅者负责推进上游
+                        flight.pulling = pull = True
+                if pull:
+                    self._pull(key, flight, fn)
+                else:
+                    yield chunk
+        finally:
+            with self._cond:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0 and not flight.done
+                if abandoned:
+                    flight.done = True
+            if abandoned:
+                # 订阅者都已退出，不会有人正在推进上游，可以直接关闭
+                self._forget(self._flights, key, flight)
+                self._close(flight)
+
+    def _forget(self, flights: Dict[str, _Flight], key: str, flight: _Flight) -> None:
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]], labels: Dict[str, str] = None) -> Any:
+        """
+        do 的异步版本，单个等待方被取消不会取消共享的上游调用
+        """
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self._count_coalesced(labels)
+        else:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+        return await asyncio.shield(task)
+
+    async def astream(self,
+                      key: str,
+                      fn: Callable[[], AsyncIterator[str]],
+                      labels: Dict[str, str] = None) -> AsyncIterator[str]:
+        """
+        stream 的异步版本
+        """
+        flight = self._aflights.get(key)
+        if flight is None or flight.loop is not asyncio.get_running_loop():
+            flight = self._aflights[key] = _Flight()
+            flight.loop = asyncio.get_running_loop()
+            flight.changed = asyncio.Event()
+            flight.task = asyncio.ensure_future(self._adrive(key, flight, fn))
+        else:
+            self._count_coalesced(labels)
+        flight.subscribers += 1
+
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    index += 1
+                    yield flight.chunks[index - 1]
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                flight.changed.clear()
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                flight.task.cancel()
+                self._forget(self._aflights, key, flight)
+
+    async def _adrive(self, key: str, flight: _Flight, fn: Callable[[], AsyncIterator[str]]) -> None:
+        chunks = fn()
+        try:
+            async for chunk in chunks:
+                flight.chunks.append(chunk)
+                flight.changed.set()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            self._forget(self._aflights, key, flight)
+            flight.done = True
+            flight.changed.set()
+
+
+if __name__ == "__main__":
+    import time
+    from concurrent.futures import ThreadPoolExecutor as Pool
+
+    upstream_calls = 0
+
+    def slow_stream():
+        global upstream_calls
+        upstream_calls += 1
+        for token in ["1. ", "分析问题", "\n2. ", "给出答案"]:
+            time.sleep(0.1)
+            yield token
+
+    group = SingleFlight(metrics=MetricsRegistry())
+    with Pool(max_workers=8) as pool:
+        results = list(pool.map(lambda _: "".join(group.stream("same-prompt", slow_stream)), range(8)))
+    print(results[0])
+    print(f"8 个并发调用，上游实际调用 {upstream_calls} 次，"
+          f"合并 {group.metrics.counter('llm_coalesced_requests_total'):.0f} 次")
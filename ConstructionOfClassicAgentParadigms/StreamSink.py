@@ -0,0 +1,159 @@
+import asyncio
+import inspect
+import sys
+from typing import Callable, List, TextIO
+
+
+class StreamSink:
+    """
+    流式输出接收端基类，LLMClient 将每个生成的文本块写入 sink
+    """
+    def write(self, chunk: str) -> None:
+        raise NotImplementedError
+
+    async def awrite(self, chunk: str) -> None:
+        """
+        异步写入，默认直接复用同步写入
+        """
+        self.write(chunk)
+
+    def flush(self) -> None:
+        pass
+
+    def end(self) -> None:
+        """
+        一次回答输出结束时调用，默认仅刷新缓冲
+        """
+        self.flush()
+
+    def close(self) -> None:
+        self.flush()
+
+
+class NullSink(StreamSink):
+    """
+    静默接收端，丢弃所有输出
+    """
+    def write(self, chunk: str) -> None:
+        pass
+
+
+class BufferedStdoutSink(StreamSink):
+    """
+    带缓冲的标准输出，攒够 buffer_size 个字符或遇到换行时才真正写出，避免每个 token 一次系统调用
+    """
+    def __init__(self, buffer_size: int = 64, stream: TextIO = None):
+        self.buffer_size = buffer_size
+        self.stream = stream
+        self._buffer: List[str] = []
+        self._buffered_chars = 0
+
+    def write(self, chunk: str) -> None:
+        self._buffer.append(chunk)
+        self._buffered_chars += len(chunk)
+        if self._buffered_chars >= self.buffer_size or "\n" in chunk:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        # 未指定输出流时每次取当前的 sys.stdout，兼容运行期的重定向
+        stream = self.stream or sys.stdout
+        stream.write("".join(self._buffer))
+        stream.flush()
+        self._buffer.clear()
+        self._buffered_chars = 0
+
+    def end(self) -> None:
+        # 输出结束后换行
+        self.write("\n")
+
+
+class FileSink(StreamSink):
+    """
+    写入文件，可传入文件路径或已打开的文件对象
+    """
+    def __init__(self, file, mode: str = "a", encoding: str = "utf-8"):
+        self._owns_file = isinstance(file, str)
+        self.file = open(file, mode, encoding=encoding) if self._owns_file else file
+
+    def write(self, chunk: str) -> None:
+        self.file.write(chunk)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._owns_file:
+            self.file.close()
+
+
+class CallbackSink(StreamSink):
+    """
+    每个文本块回调一次用户函数
+    """
+    def __init__(self, callback: Callable[[str], None]):
+        self.callback = callback
+
+    def write(self, chunk: str) -> None:
+        self.callback(chunk)
+
+
+class WebSocketSink(StreamSink):
+    """
+    推送到 WebSocket 连接
+
+    send 可以是同步函数，也可以是协程函数（如 websocket.send_text）。
+    在同步的 generate 中使用协程函数时，需要传入 websocket 所在的事件循环 loop。
+    """
+    def __init__(self, send: Callable, loop: asyncio.AbstractEventLoop = None):
+        self.send = send
+        self.loop = loop
+        self._is_async = inspect.iscoroutinefunction(send)
+
+    def write(self, chunk: str) -> None:
+        if not self._is_async:
+            self.send(chunk)
+            return
+        if self.loop is None:
+            raise ValueError("同步写入异步 WebSocket 时必须提供事件循环 loop")
+        asyncio.run_coroutine_threadsafe(self.send(chunk), self.loop).result()
+
+    async def awrite(self, chunk: str) -> None:
+        if self._is_async:
+            await self.send(chunk)
+        else:
+            self.send(chunk)
+
+
+if __name__ == "__main__":
+    # 微基准：比较逐 token print(flush=True) 与各类 sink 的单 token 开销
+    import os
+    import time
+
+    token_count = 200_000
+    tokens = ["词"] * token_count
+
+    def bench(name: str, write: Callable[[str], None], finish: Callable[[], None] = None) -> None:
+        start = time.perf_counter()
+        for token in tokens:
+            write(token)
+        if finish:
+            finish()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<28} {elapsed * 1e9 / token_count:>10.1f} ns/token")
+
+    with open(os.devnull, "w") as devnull:
+        bench("print(flush=True)", lambda t: print(t, end="", flush=True, file=devnull))
+
+        buffered = BufferedStdoutSink(buffer_size=64, stream=devnull)
+        bench("BufferedStdoutSink(64)", buffered.write, buffered.end)
+
+        buffered = BufferedStdoutSink(buffer_size=1024, stream=devnull)
+        bench("BufferedStdoutSink(1024)", buffered.write, buffered.end)
+
+        collected = []
+        bench("CallbackSink(list.append)", CallbackSink(collected.append).write)
+
+        bench("NullSink", NullSink().write)
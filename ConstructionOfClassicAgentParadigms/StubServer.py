@@ -0,0 +1,496 @@
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from typing import Any, Callable, Dict, List, Union
+
+from RateLimiter import estimate_tokens
+
+
+def parse_distribution(spec: Union[str, float], rng: random.Random = None) -> Callable[[], float]:
+    """
+    把延迟分布描述解析为采样函数，单位为秒，结果不小于 0
+
+    - "0.3"                 固定值
+    - "uniform:0.1,0.5"     均匀分布
+    - "normal:0.3,0.05"     正态分布（均值, 标准差）
+    - "lognormal:0.3,0.5"   对数正态分布（中位数, sigma），适合模拟长尾的 TTFT
+    - "exp:0.3"             指数分布（均值）
+    """
+    rng = rng or random.Random()
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        value = float(kind)
+        return lambda: value
+    params = [float(x) for x in args.split(",")]
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda: params[0] * rng.lognormvariate(0, params[1])
+    if kind == "exp":
+        return lambda: rng.expovariate(1 / params[0])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+class LatencyModel:
+    """
+    模拟模型服务的延迟：首 token 延迟（TTFT）与逐 token 间隔分别按给定分布采样
+    """
+    def __init__(self, ttft: Union[str, float] = 0.3, inter_token: Union[str, float] = 0.02, seed: int = None):
+        rng = random.Random(seed)
+        self.sample_ttft = parse_distribution(ttft, rng)
+        self.sample_inter_token = parse_distribution(inter_token, rng)
+
+
+def _last_user(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return _text(message.get("content"))
+    return ""
+
+
+def _text(content: Any) -> str:
+    # 兼容 content 为多模态分段列表的写法
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def echo_responder(body: Dict[str, Any]) -> str:
+    return f"echo: {_last_user(body.get('messages') or [])}"
+
+
+def react_responder(body: Dict[str, Any]) -> str:
+    """
+    按已有 Observation 的数量依次给出工具调用，最后给出 finish，匹配 QuickStart 的 ReAct 格式；
+    与真实模型一样，工具调用之后会继续编造 Observation，用于验证 stop 序列与提前结束
+    """
+    prompt = "\n".join(_text(m.get("content")) for m in body.get("messages") or [])
+    step = prompt.count("Observation:")
+    hallucinated = "\nObservation: 广州今天多云。\nThought: 接下来推荐景点。\nAction: finish(answer=\"编造的答案\")"
+    if step == 0:
+        return "Thought: 需要先查询城市天气。\nAction: get_weather(city='广州')" + hallucinated
+    if step == 1:
+        return "Thought: 已知天气，接下来搜索适合的景点。\nAction: get_attraction(city='广州', weather='晴')" + hallucinated
+    return 'Thought: 信息已足够。\nAction: finish(answer="广州今天晴，推荐游览白云山和珠江夜游。")'
+
+
+def plan_responder(body: Dict[str, Any]) -> str:
+    """
+    输出 PlanAndSolveAgent 可解析的带依赖计划，其余调用（执行步骤）返回简短结果
+    """
+    prompt = "\n".join(_text(m.get("content")) for m in body.get("messages") or [])
+    if "```python" in prompt:
+        return ('```python\n[{"id": 1, "task": "查询 A 的信息", "deps": []}, '
+                '{"id": 2, "task": "查询 B 的信息", "deps": []}, '
+                '{"id": 3, "task": "对比 A 与 B 得出结论", "deps": [1, 2]}]\n```')
+    return "这一步的结果是 42。"
+
+
+def react_agent_responder(body: Dict[str, Any]) -> Union[str, Dict[str, Any]]:
+    """
+    匹配 ReAct/ReActAgent 的两种模式：请求带 tools 时先并行调用两次第一个工具、再给出答案；
+    否则按文本协议 tool[input] 依次调用两次工具，最后给出 Finish[...]
+    """
+    messages = body.get("messages") or []
+    answer = "A 与 B 的信息都已查到，综合来看 A 更合适。"
+    tools = body.get("tools") or []
+    if tools:
+        if any(m.get("role") == "tool" for m in messages):
+            return answer
+        function = tools[0].get("function") or {}
+        param = ((function.get("parameters") or {}).get("required") or ["input"])[0]
+        return {"content": "", "tool_calls": [
+            {"name": function.get("name", "search"), "arguments": {param: f"{topic} 的信息"}} for topic in ("A", "B")
+        ]}
+
+    prompt = "\n".join(_text(m.get("content")) for m in messages)
+    names = re.findall(r"^\s*- (\w+):", prompt, re.MULTILINE)
+    tool = names[0] if names else "search"
+    step = prompt.count("Observation:")
+    if step == 0:
+        return f"Thought: 需要先查询 A。\nAction: {tool}[A 的信息]"
+    if step == 1:
+        return f"Thought: 再查询 B。\nAction: {tool}[B 的信息]"
+    return f"Thought: 信息已足够。\nAction: Finish[{answer}]"
+
+
+WEREWOLF_NAMES = ["刘备", "关羽", "张飞", "诸葛亮", "赵云", "曹操", "司马懿", "周瑜", "孙权"]
+
+
+def werewolf_responder(body: Dict[str, Any]) -> str:
+    """
+    返回狼人杀各阶段都能解析的 JSON，目标玩家从提示词中出现的玩家名里随机选择
+    """
+    prompt = "\n".join(_text(m.get("content")) for m in body.get("messages") or [])
+    names = [name for name in WEREWOLF_NAMES if name in prompt] or WEREWOLF_NAMES
+    target = random.choice(names)
+    return json.dumps({
+        "speech": f"我觉得{target}的发言前后矛盾，值得怀疑。",
+        "reach_agreement": True,
+        "confidence_level": random.randint(5, 9),
+        "vote": target,
+        "target": target,
+        "target_name": target,
+        "reason": f"{target}的行为可疑",
+        "check_reason": f"{target}的发言最有信息量",
+        "kill_strategy": "优先击杀发言最有威胁的玩家",
+        "use_antidote": False,
+        "use_poison": False,
+        "shoot": False,
+    }, ensure_ascii=False)
+
+
+RESPONDERS: Dict[str, Callable[[Dict[str, Any]], Union[str, Dict[str, Any]]]] = {
+    "echo": echo_responder,
+    "react": react_responder,
+    "plan": plan_responder,
+    "werewolf": werewolf_responder,
+    "react_agent": react_agent_responder,
+}
+
+
+class ScriptedResponder:
+    """
+    按规则返回脚本化的回复：依次用正则匹配最后一条用户消息，命中后用 string.Template 渲染回复，
+    模板中可使用 $last_user 与 $model；都未命中时交给 default 处理
+
+    规则文件为 JSON 列表，例如 [{"match": "天气", "response": "Thought: ...\\nAction: ..."}]，
+    response 也可以写成内置模板名（如 "react"）。
+    """
+    def __init__(self, rules: List[Dict[str, str]], default: Callable[[Dict[str, Any]], str] = echo_responder):
+        self.rules = [(re.compile(rule["match"], re.DOTALL), rule["response"]) for rule in rules]
+        self.default = default
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ScriptedResponder":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def __call__(self, body: Dict[str, Any]) -> str:
+        last_user = _last_user(body.get("messages") or [])
+        for pattern, response in self.rules:
+            if pattern.search(last_user):
+                if response in RESPONDERS:
+                    return RESPONDERS[response](body)
+                return Template(response).safe_substitute(last_user=last_user, model=body.get("model", ""))
+        return self.default(body)
+
+
+def _apply_stop(text: str, stop: Union[str, List[str], None]) -> str:
+    """
+    与真实服务一致：在第一个 stop 序列处截断，且不包含 stop 序列本身
+    """
+    if not stop:
+        return text
+    for sequence in [stop] if isinstance(stop, str) else stop:
+        index = text.find(sequence)
+        if index >= 0:
+            text = text[:index]
+    return text
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    把回复切成模拟的 token：英文按单词、中文按单字
+    """
+    return re.findall(r"[A-Za-z0-9_]+|\s+|.", text, re.DOTALL)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_StubHTTPServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.stub.stats())
+        else:
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+            return
+        stub = self.server.stub
+        stub._enter()
+        try:
+            self._chat_completions(stub, body)
+        finally:
+            stub._leave()
+
+    def _chat_completions(self, stub: "StubServer", body: Dict[str, Any]) -> None:
+        status = stub._sample_error()
+        if status is not None:
+            time.sleep(stub.latency.sample_ttft())
+            self._send_json(status, {"error": {"message": f"注入的错误 {status}", "type": "stub_error"}})
+            return
+
+        reply = stub.responder(body)
+        tool_calls = []
+        if isinstance(reply, dict):
+            # 原生工具调用：{"content": ..., "tool_calls": [{"name": ..., "arguments": {...}}]}
+            tool_calls = [{
+                "id": f"call_{next(stub._ids)}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments") or {}, ensure_ascii=False)},
+            } for call in reply.get("tool_calls") or []]
+            reply = reply.get("content") or ""
+        text = _apply_stop(reply, body.get("stop"))
+        tokens = tokenize(text)
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        completion_id = f"chatcmpl-stub-{next(stub._ids)}"
+        usage = {
+            "prompt_tokens": estimate_tokens(body.get("messages") or [], completion_tokens=0),
+            "completion_tokens": len(tokens) + sum(len(tokenize(call["function"]["arguments"])) for call in tool_calls),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        usage["prompt_tokens_details"] = {"cached_tokens": stub._cached_prefix_tokens(body.get("messages") or [])}
+        base = {"id": completion_id, "created": int(time.time()), "model": body.get("model", "stub-model")}
+
+        if not body.get("stream"):
+            time.sleep(stub.latency.sample_ttft() + sum(stub.latency.sample_inter_token() for _ in tokens[1:]))
+            message = {"role": "assistant", "content": text}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": finish_reason, "message": message,
+            }]))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        abort_at = stub._sample_abort(len(tokens))
+        time.sleep(stub.latency.sample_ttft())
+        for i, token in enumerate(tokens):
+            if i == abort_at:
+                # 模拟流式输出中途断开连接
+                self.close_connection = True
+                return
+            if i:
+                time.sleep(stub.latency.sample_inter_token())
+            self._send_event(dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0, "finish_reason": None, "delta": {"role": "assistant", "content": token} if i == 0 else {"content": token},
+            }]))
+        for index, call in enumerate(tool_calls):
+            self._send_event(dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0, "finish_reason": None, "delta": {"role": "assistant", "tool_calls": [dict(call, index=index)]},
+            }]))
+        self._send_event(dict(base, object="chat.completion.chunk", choices=[{
+            "index": 0, "finish_reason": finish_reason, "delta": {},
+        }]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def _send_event(self, payload: Dict[str, Any]) -> None:
+        self._send_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _send_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    stub: "StubServer"
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开（如拿到完整 Action 后主动关闭流）属于正常情况
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """
+    本地 OpenAI 兼容的模拟服务，用于压测 Agent 侧的开销
+
+    支持 /v1/chat/completions（含 SSE 流式与 stream_options.include_usage）、/v1/models，
+    以及返回服务端统计的 /v1/stats。回复由 responder 生成，可以是内置模板名
+    （echo / react / plan / werewolf / react_agent）、ScriptedResponder 或任意 body -> str 的函数；
+    函数也可以返回 {"content", "tool_calls"} 字典，模拟原生工具调用；
+    延迟由 LatencyModel 采样，error_rate 按比例注入 error_statuses 中的错误，
+    abort_rate 按比例在流式输出中途断开连接。
+    还会按消息粒度模拟服务端的前缀缓存，在 usage.prompt_tokens_details.cached_tokens 中返回命中的 token 数。
+    """
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 responder: Union[str, Callable[[Dict[str, Any]], str]] = "echo",
+                 latency: LatencyModel = None,
+                 error_rate: float = 0.0,
+                 error_statuses: List[int] = (429, 500, 503),
+                 abort_rate: float = 0.0,
+                 seed: int = None):
+        self.responder = RESPONDERS[responder] if isinstance(responder, str) else responder
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.abort_rate = abort_rate
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        # 模拟的前缀缓存：消息前缀的哈希 -> 该前缀的 token 数
+        self._prefixes: "OrderedDict[str, int]" = OrderedDict()
+        self._max_prefixes = 10000
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._aborts = 0
+        self._inflight = 0
+        self._max_inflight = 0
+
+        self._server = _StubHTTPServer((host, port), _StubHandler)
+        self._server.stub = self
+        self._thread: threading.Thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubServer":
+        """
+        在后台线程中启动服务
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _enter(self) -> None:
+        with self._lock:
+            self._requests += 1
+            self._inflight += 1
+            self._max_inflight = max(self._max_inflight, self._inflight)
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+
+    def _sample_error(self):
+        if self.error_rate and self._random.random() < self.error_rate:
+            with self._lock:
+                self._errors += 1
+            return self._random.choice(self.error_statuses)
+        return None
+
+    def _sample_abort(self, token_count: int):
+        if token_count > 1 and self.abort_rate and self._random.random() < self.abort_rate:
+            with self._lock:
+                self._aborts += 1
+            return self._random.randint(1, token_count - 1)
+        return None
+
+    def _cached_prefix_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        返回此前请求中出现过的最长消息前缀的 token 数，并记录本次请求的所有前缀
+        """
+        digest = hashlib.sha256()
+        prefixes = []
+        for i, message in enumerate(messages):
+            digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+            prefixes.append((digest.hexdigest(), i + 1))
+        cached = 0
+        with self._lock:
+            for key, length in prefixes:
+                if key in self._prefixes:
+                    cached = self._prefixes[key]
+                    self._prefixes.move_to_end(key)
+                else:
+                    self._prefixes[key] = estimate_tokens(messages[:length], completion_tokens=0)
+            while len(self._prefixes) > self._max_prefixes:
+                self._prefixes.popitem(last=False)
+        return cached
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "errors": self._errors,
+                "aborts": self._aborts,
+                "inflight": self._inflight,
+                "max_inflight": self._max_inflight,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--responder", default="echo", choices=sorted(RESPONDERS),
+                        help="内置回复模板，--script 未命中时也使用它")
+    parser.add_argument("--script", help="脚本化回复规则（JSON 文件）")
+    parser.add_argument("--ttft", default="0.3", help="首 token 延迟分布，如 0.3 / lognormal:0.3,0.5")
+    parser.add_argument("--inter-token", default="0.02", help="token 间隔分布，如 0.02 / uniform:0.01,0.04")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-statuses", default="429,500,503")
+    parser.add_argument("--abort-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    responder = RESPONDERS[args.responder]
+    if args.script:
+        responder = ScriptedResponder.from_file(args.script, default=responder)
+    stub = StubServer(
+        host=args.host,
+        port=args.port,
+        responder=responder,
+        latency=LatencyModel(ttft=args.ttft, inter_token=args.inter_token, seed=args.seed),
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_statuses.split(",")],
+        abort_rate=args.abort_rate,
+        seed=args.seed,
+    )
+    print(f"🚀 模拟服务已启动: {stub.base_url}")
+    print(f"   export OPENAI_API_BASE_URL={stub.base_url} OPENAI_API_KEY=stub")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n统计: {stub.stats()}")
+
+
+if __name__ == "__main__":
+    main()
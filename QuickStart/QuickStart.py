@@ -1,44 +1,366 @@
+import argparse
+import json
 import requests
 import os
 import re
+import sys
+import threading
+import time
+import httpx
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from tavily import TavilyClient
 from openai import OpenAI
 
+# 复用手写范式中的录制/回放磁带：配置 LLM_CASSETTE 后模型调用与工具调用都可离线回放
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ConstructionOfClassicAgentParadigms"))
+from Cassette import get_shared_cassette
+from ContextWindow import ContextWindow
+
+
+def _silent(*args, **kwargs) -> None:
+    pass
+
 
 class OpenAICompatibleClient:
     """
     OpenAI兼容客户端, 用于与OpenAI API兼容
     """
-    def __init__(self, model: str, api_key: str, base_url: str):
+    def __init__(self, model: str, api_key: str, base_url: str, quiet: bool = False):
         self.model = model
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
-
-    def generate(self, prompt: str, system_prompt: str) -> str:
+        self.quiet = quiet
+        cassette = get_shared_cassette()
+        # 最近一次调用的统计（发送字节数、token 用量、是否提前结束）按线程保存，批量并发运行时互不干扰
+        self._local = threading.local()
+        http_client = httpx.Client(
+            transport=cassette.transport() if cassette else None,
+            event_hooks={"request": [self._on_request]}
+        )
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+    @property
+    def last_request_bytes(self) -> int:
+        return getattr(self._local, "request_bytes", 0)
+
+    @property
+    def last_usage(self) -> dict:
+        return getattr(self._local, "usage", {})
+
+    @property
+    def last_aborted(self) -> bool:
+        return getattr(self._local, "aborted", False)
+
+    def _on_request(self, request: httpx.Request) -> None:
+        # 记录每次请求实际发送的字节数，用于对比不同提示词组织方式的开销
+        self._local.request_bytes = len(request.content)
+
+    def generate(self, prompt: str, system_prompt: str, stream: bool = False) -> str:
         """
         生成文本
 
         :param prompt: 用户提示词
         :param system_prompt: 系统提示词
+        :param stream: 是否流式生成并在得到完整 Action 后提前结束
         :return 生成的文本
         """
-        print(f"Generating text with model: {self.model}")
+        return self.chat([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ], stream=stream)
+
+    def chat(self, messages: list[dict], stream: bool = False) -> str:
+        """
+        按多轮对话消息生成文本，本次调用的 token 用量（含命中缓存的 token 数）记录在 last_usage 中
+
+        :param messages: 对话消息
+        :param stream: 是否流式生成并在得到完整 Action 后提前结束
+        :return 生成的文本
+        """
+        log = _silent if self.quiet else print
+        log(f"Generating text with model: {self.model}")
+        self._local.usage = {}
+        self._local.aborted = False
         try:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ]
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                stream=False
-            )
-
-            answer = response.choices[0].message.content
-            print(f"Generated answer: \n{answer}")
+            if stream:
+                answer = self._chat_stream(messages)
+            else:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stop=REACT_STOP_SEQUENCES,
+                    stream=False
+                )
+                self._local.usage = _usage_dict(response.usage)
+                answer = response.choices[0].message.content
+            log(f"Generated answer: \n{answer}")
             return answer
         except Exception as e:
             return f'错误: 调用OpenAI API失败: {e}'
 
+    def _chat_stream(self, messages: list[dict]) -> str:
+        parser = ActionStreamParser()
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stop=REACT_STOP_SEQUENCES,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        try:
+            for chunk in response:
+                if chunk.usage is not None:
+                    self._local.usage = _usage_dict(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content and parser.feed(chunk.choices[0].delta.content):
+                    # 本轮的 Action 已全部完整，关闭连接让服务端停止生成后续内容
+                    self._local.aborted = True
+                    break
+        finally:
+            response.close()
+        return parser.text()
+
+
+# 模型在 Action 之后常会自行编造 Observation，让服务端遇到它时直接停止生成
+REACT_STOP_SEQUENCES = ["Observation:"]
+
+
+class ActionStreamParser:
+    """
+    增量解析流式输出的 Thought/Action，识别到完整的 Action 后即可停止生成
+
+    Action 的括号配平（忽略引号内的括号）即视为完整，如 get_weather(city='广州') 或多行的 finish(answer="...")；
+    不带括号的 Action 以换行结束。一轮中可以有多行 Action：某个 Action 完整后，若下一行不再以 Action: 开头
+    （或已是 finish）即结束。每个字符只扫描一次。
+    """
+    ACTION = "Action:"
+
+    def __init__(self):
+        self.buffer = ""
+        self.result = None
+        self._start = None
+        self._end = None
+        self._pos = 0
+        self._depth = 0
+        self._quote = None
+        self._escape = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+        追加一段输出，返回本轮的 Action 是否已全部完整
+        """
+        if self.result is not None:
+            return True
+        self.buffer += chunk
+        while True:
+            if self._start is None:
+                if self._end is None:
+                    # 只在新增内容（及可能跨块的前缀）中查找，避免重复扫描
+                    index = self.buffer.find(self.ACTION, max(0, self._pos - len(self.ACTION)))
+                    if index < 0:
+                        self._pos = len(self.buffer)
+                        return False
+                    self._begin(index)
+                else:
+                    rest = self.buffer[self._end:].lstrip()
+                    if rest.startswith(self.ACTION):
+                        self._begin(len(self.buffer) - len(rest))
+                    elif self.ACTION.startswith(rest):
+                        # 还不能确定下一行是否仍是 Action
+                        return False
+                    else:
+                        self.result = self.buffer[:self._end]
+                        return True
+            if not self._scan():
+                return False
+            if self.buffer[self._start:self._end].strip().startswith("finish"):
+                self.result = self.buffer[:self._end]
+                return True
+            self._start = None
+
+    def _begin(self, index: int) -> None:
+        self._start = self._pos = index + len(self.ACTION)
+        self._depth = 0
+        self._quote = None
+        self._escape = False
+
+    def _scan(self) -> bool:
+        """
+        从上次停下的位置继续扫描当前 Action，完整时记录结束位置并返回 True
+        """
+        buffer = self.buffer
+        for i in range(self._pos, len(buffer)):
+            c = buffer[i]
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == self._quote:
+                    self._quote = None
+            elif c in "\"'" and self._depth > 0:
+                self._quote = c
+            elif c == "(":
+                self._depth += 1
+            elif c == ")" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = self._pos = i + 1
+                    return True
+            elif c == "\n" and self._depth == 0 and buffer[self._start:i].strip():
+                self._end = self._pos = i
+                return True
+        self._pos = len(buffer)
+        return False
+
+    def text(self) -> str:
+        """
+        截断到第一个完整 Action 的输出；流结束仍不完整时返回全部内容
+        """
+        return self.result if self.result is not None else self.buffer
+
+
+def _usage_dict(usage) -> dict:
+    """
+    提取 token 用量；命中前缀缓存的 token 数在 OpenAI 中位于 prompt_tokens_details.cached_tokens，
+    DeepSeek 则使用 prompt_cache_hit_tokens
+    """
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None) or (usage.model_extra or {}).get("prompt_cache_hit_tokens")
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": cached or 0,
+    }
+
+
+class TTLCache:
+    """
+    带过期时间的内存缓存，支持 stale-while-revalidate
+
+    - 未超过 ttl：直接返回缓存值
+    - 超过 ttl 但未超过 ttl + stale_ttl：立即返回旧值，同时在后台线程刷新（同一个 key 只刷新一次）
+    - 更旧或不存在：同步加载；同一个 key 的并发加载只执行一次
+    loader 抛出异常时不缓存结果；后台刷新失败时继续使用旧值。
+    """
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0.0, max_entries: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._key_locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = now - entry[1]
+            if age < self.ttl:
+                self._count("hits")
+                return entry[0]
+            if age < self.ttl + self.stale_ttl:
+                self._count("stale_hits")
+                self._refresh_in_background(key, loader)
+                return entry[0]
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # 等锁期间其他线程可能已经加载完成
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._count("hits")
+                return entry[0]
+            self._count("misses")
+            try:
+                value = loader()
+            except Exception:
+                self._count("errors")
+                raise
+            self._store(key, value)
+            return value
+
+    def _store(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            if len(self._entries) > self.max_entries:
+                # 淘汰最早写入的条目
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest]
+                self._key_locks.pop(oldest, None)
+
+    def _refresh_in_background(self, key, loader) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                self._store(key, loader())
+                self._count("refreshes")
+            except Exception:
+                self._count("errors")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_refresh, name=f"{self.name}-refresh", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+            hit_rate = (self._stats["hits"] + self._stats["stale_hits"]) / lookups if lookups else 0.0
+            return dict(self._stats, entries=len(self._entries), hit_rate=round(hit_rate, 4))
+
+
+# 工具共享的 HTTP 连接池，复用与 wttr.in 的 keep-alive 连接
+HTTP_TIMEOUT = (3.05, 10)
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# 天气按城市缓存 10 分钟，过期后 30 分钟内先返回旧值再后台刷新；景点按城市 + 天气缓存 6 小时
+weather_cache = TTLCache("weather", ttl=600, stale_ttl=1800)
+attraction_cache = TTLCache("attraction", ttl=6 * 3600, stale_ttl=24 * 3600)
+
+_tavily_client = None
+_tavily_lock = threading.Lock()
+
+
+def _get_tavily() -> TavilyClient:
+    """
+    进程内共享的 Tavily 客户端
+    """
+    global _tavily_client
+    with _tavily_lock:
+        if _tavily_client is None:
+            _tavily_client = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+        return _tavily_client
+
+
+def _fetch_weather(city: str) -> str:
+    response = _http_session.get(f"https://wttr.in/{city}?format=j1", timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+
+    # 解析数据
+    current_condition = data['current_condition'][0]
+    weather_desc = current_condition['weatherDesc'][0]['value']
+    temp_c = current_condition['temp_C']
+
+    return f'{city}当前天气：{weather_desc}, 气温：{temp_c} 摄氏度'
+
 
 def get_weather(city: str) -> str:
     """
@@ -48,20 +370,8 @@ def get_weather(city: str) -> str:
         Returns:
             str: 天气信息
     """
-
-    url = f"https://wttr.in/{city}?format=j1"
     try:
-        # 发起请求
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-
-        # 解析数据
-        current_condition = data['current_condition'][0]
-        weather_desc = current_condition['weatherDesc'][0]['value']
-        temp_c = current_condition['temp_C']
-
-        return f'{city}当前天气：{weather_desc}, 气温：{temp_c} 摄氏度'
+        return weather_cache.get_or_load(city.strip(), lambda: _fetch_weather(city))
     except requests.exceptions.RequestException as e:
         return f"错误：查询天气遇到网络问题: {e}"
 
@@ -69,6 +379,23 @@ def get_weather(city: str) -> str:
         return f'错误：解析天气数据失败：{e}'
 
 
+def _search_attraction(city: str, weather: str) -> str:
+    query = f"'{city}' 在 '{weather}' 天气下值得去的旅游景点以及推荐理由"
+    response = _get_tavily().search(query=query, search_depth='basic', include_answer=True, timeout=HTTP_TIMEOUT[1])
+
+    if response.get("answer"):
+        return response["answer"]
+
+    formatted_results = []
+    for result in response.get("results", []):
+        formatted_results.append(f"- {result['title']}: {result['content']}")
+
+    if not formatted_results:
+        return "抱歉，没有找到可推荐的景点"
+
+    return "根据搜索，为您找到以下信息：\n".join(formatted_results)
+
+
 def get_attraction(city: str, weather: str) -> str:
     """
     获取旅游景点
@@ -78,38 +405,83 @@ def get_attraction(city: str, weather: str) -> str:
         Returns:
             str: 旅游景点信息
     """
-    # 初始化客户端
-    tavily = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
-
-    query = f"'{city}' 在 '{weather}' 天气下值得去的旅游景点以及推荐理由"
-
     try:
-        response = tavily.search(query=query, search_depth='basic', include_answer=True)
-
-        if response.get("answer"):
-            return response["answer"]
-
-        formatted_results = []
-        for result in response.get("results", []):
-            formatted_results.append(f"- {result['title']}: {result['content']}")
-
-        if not formatted_results:
-            return "抱歉，没有找到可推荐的景点"
-
-        return "根据搜索，为您找到以下信息：\n".join(formatted_results)
-
+        return attraction_cache.get_or_load((city.strip(), weather.strip()), lambda: _search_attraction(city, weather))
     except Exception as e:
         return f"错误：执行搜索时遇到网络问题: {e}"
 
 
+def tool_cache_stats() -> dict:
+    """
+    工具缓存的命中统计
+    """
+    return {cache.name: cache.stats() for cache in (weather_cache, attraction_cache)}
+
+
 available_tools = {
     "get_weather": get_weather,
     "get_attraction": get_attraction
 }
 
+if get_shared_cassette() is not None:
+    available_tools = {name: get_shared_cassette().wrap_tool(name, func) for name, func in available_tools.items()}
 
-def main():
-    AGENT_SYSTEM_PROMPT = """
+
+# 各工具的超时时间（秒），未列出的工具使用 DEFAULT_TOOL_TIMEOUT
+TOOL_TIMEOUTS = {
+    "get_weather": 10,
+    "get_attraction": 20
+}
+DEFAULT_TOOL_TIMEOUT = 15
+
+# 工具调用共享的线程池，同一轮中的多个 Action 并行执行；批量运行时由所有 Agent 共用
+_tool_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tool")
+
+
+def parse_action(action_str: str) -> tuple[str, dict]:
+    """
+    解析 function_name(arg_name='arg_value', ...) 形式的 Action，返回工具名与参数
+    """
+    tool_name = re.search(r"(\w+)\(", action_str).group(1)
+    args_str = re.search(r"\((.*)\)", action_str, re.DOTALL).group(1)
+    # 支持单引号和双引号
+    return tool_name, dict(re.findall(r'(\w+)=["\']([^"\']*)["\']', args_str))
+
+
+def execute_actions(action_strs: list[str]) -> list[str]:
+    """
+    在线程池中并行执行多个 Action，按顺序返回各自的 Observation；单个工具超时或出错不影响其他工具
+    """
+    started = time.monotonic()
+    futures = []
+    for action_str in action_strs:
+        try:
+            tool_name, kwargs = parse_action(action_str)
+        except AttributeError:
+            futures.append((action_str, None, f'错误：无法解析 Action "{action_str}"'))
+            continue
+        if tool_name not in available_tools:
+            futures.append((tool_name, None, f'错误：未定义工具 "{tool_name}"'))
+            continue
+        futures.append((tool_name, _tool_executor.submit(available_tools[tool_name], **kwargs), None))
+
+    observations = []
+    for tool_name, future, error in futures:
+        if future is None:
+            observations.append(error)
+            continue
+        timeout = TOOL_TIMEOUTS.get(tool_name, DEFAULT_TOOL_TIMEOUT)
+        try:
+            observations.append(future.result(timeout=max(0.0, started + timeout - time.monotonic())))
+        except FutureTimeoutError:
+            future.cancel()
+            observations.append(f"错误：工具 {tool_name} 执行超时（{timeout}s）")
+        except Exception as e:
+            observations.append(f"错误：工具 {tool_name} 执行失败: {e}")
+    return observations
+
+
+AGENT_SYSTEM_PROMPT = """
     你是一个旅行智能助手。你的任务是分析用户需求，使用合适的工具一步步解决用户提取的需求。
 
     # 可用工具
@@ -117,10 +489,12 @@ def main():
     - `get_attraction(city: str, weather: str)`: 根据城市和天气搜索推荐的旅游景点。
 
     # 行动模式：
-    首先是你的思考过程，然后是你要执行的具体行动，每次回复只输出一对 Thought 和 Action（必须输出一对），如果某一步重试三次后再遇到问题则报错结束，报错信息由你定义。
+    首先是你的思考过程，然后是你要执行的具体行动，每次回复只输出一个 Thought 和至少一个 Action，如果某一步重试三次后再遇到问题则报错结束，报错信息由你定义。
     你的回答必须严格遵守以下格式：
     Thought:[这里是你的思考过程和下一步计划]
     Action:[这里是你要调用的工具，格式为：function_name(arg_name='arg_value')]
+    多个互不依赖的工具调用（例如同时查询多个城市的天气）可以在同一轮中一次给出，每个调用单独占一行 Action，它们会被并行执行，
+    所有结果会在下一条 Observation 中按顺序编号返回。
 
     # 任务完成
     当你收集到足够多的信息，能够回答用户问题时，你必须在 `Action` 字段后使用 `finish(answer="....")` 来输出最终答案，以 markdown 的形式输出
@@ -130,59 +504,230 @@ def main():
 
     """
 
-    client = OpenAICompatibleClient(
-        model="deepseek-chat",
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_API_BASE_URL")
-    )
 
-    user_prompt = "帮我查询今天广州的天气，根据今天的天气推荐几个合适的旅游景点，输出要详细"
+def run_agent(client: OpenAICompatibleClient,
+              user_prompt: str,
+              mode: str = "messages",
+              stream: bool = True,
+              max_turns: int = 10,
+              quiet: bool = False) -> dict:
+    """
+    运行 ReAct 主循环
+
+    Args:
+        client: 模型客户端
+        user_prompt: 用户请求
+        mode: 提示词组织方式
+            - messages：系统提示词固定不变，历史以只追加的多轮消息发送，服务端可以复用已缓存的前缀
+            - joined：每轮把全部历史拼成一条用户消息重新发送（原始做法，无法命中前缀缓存）
+        stream: 流式生成，识别到第一个完整的 Action 后立即结束，不再为多余的输出付费
+        max_turns: 最大轮数
+        quiet: 静默模式，不做控制台输出
+    Returns:
+        dict: answer（最终答案，未完成时为 None）、rounds（调用模型的轮数）以及发送字节数与 token 用量
+    """
+    log = _silent if quiet else print
+    # 历史超出 token 预算时丢弃最早的 Thought/Observation，始终保留用户请求；
+    # 多轮消息模式下 Action 与其 Observation 成对丢弃
+    context_window = ContextWindow(max_tokens=6000, keep_first=1, group_turns=True)
     prompt_history = [f'用户请求: {user_prompt}']
+    messages = [
+        {"role": "system", "content": AGENT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt_history[0]}
+    ]
+    totals = {"bytes": 0, "prompt_tokens": 0, "cached_tokens": 0}
+    final_answer = None
+    rounds = 0
 
-    print(f"用户输入: {user_prompt}\n" + "=" * 40)
+    log(f"用户输入: {user_prompt}\n" + "=" * 40)
 
     # 运行主循环
-    for i in range(10):
-        print(f"--- 第{i + 1}轮思考 ---")
+    for i in range(max_turns):
+        log(f"--- 第{i + 1}轮思考 ---")
+        rounds += 1
+
+        if mode == "messages":
+            llm_output = client.chat(context_window.fit(messages, label="QuickStart"), stream=stream)
+        else:
+            full_prompt = "\n".join(context_window.fit_texts(prompt_history, label="QuickStart"))
+            llm_output = client.generate(full_prompt, system_prompt=AGENT_SYSTEM_PROMPT, stream=stream)
+        _report_turn(client, totals, log)
 
-        full_prompt = "\n".join(prompt_history)
-        llm_output = client.generate(full_prompt, system_prompt=AGENT_SYSTEM_PROMPT)
         # 模型可能会输出多余的 Thought-Action,需要截断
-        match = re.search(r'(Thought:\s*.*?Action:\s*.*?)(?=\n\s*(?:Thought:|Action:|Observation:)|\Z)',
+        match = re.search(r'(Thought:\s*.*?Action:\s*.*?)(?=\n\s*(?:Thought:|Observation:)|\Z)',
                           llm_output, re.DOTALL)
         if match:
             truncated = match.group(1).strip()
             if truncated != llm_output.strip():
                 llm_output = truncated
-                print(f"截断后的输出: {llm_output}")
-        print(f"LLM输出: \n{llm_output}")
+                log(f"截断后的输出: {llm_output}")
+        log(f"LLM输出: \n{llm_output}")
         prompt_history.append(llm_output)
+        messages.append({"role": "assistant", "content": llm_output})
 
-        action_match = re.search(r"Action:\s*(.*)", llm_output, re.DOTALL)
-        if not action_match:
-            print("解析错误：模型输出未找到 Action")
+        action_strs = [a.strip() for a in re.findall(r"Action:\s*(.*?)(?=\n\s*Action:|\Z)", llm_output, re.DOTALL)]
+        if not action_strs:
+            log("解析错误：模型输出未找到 Action")
             break
 
-        action_str = action_match.group(1).strip()
-
-        if action_str.startswith("finish"):
-            final_answer = re.search(r'finish\(answer=["\'](.*)["\']\)', action_str).group(1)
-            print(f"最终答案: {final_answer}")
+        finish_str = next((a for a in action_strs if a.startswith("finish")), None)
+        if finish_str is not None:
+            final_answer = re.search(r'finish\(answer=["\'](.*)["\']\)', finish_str, re.DOTALL).group(1)
+            log(f"最终答案: {final_answer}")
             break
 
-        tool_name = re.search(r"(\w+)\(", action_str).group(1)
-        args_str = re.search(r"\((.*)\)", action_str).group(1)
-        # 支持单引号和双引号
-        kwargs = dict(re.findall(r'(\w+)=["\']([^"\']*)["\']', args_str))
-
-        if tool_name in available_tools:
-            observation = available_tools[tool_name](**kwargs)
+        observations = execute_actions(action_strs)
+        if len(observations) == 1:
+            observation = observations[0]
         else:
-            observation = f'错误：未定义工具 "{tool_name}"'
+            observation = "\n".join(f"[{n}] {a}: {o}" for n, (a, o) in enumerate(zip(action_strs, observations), 1))
 
         observation_str = f"Observation: {observation}"
-        print(f'{observation_str}\n' + '=' * 80)
+        log(f'{observation_str}\n' + '=' * 80)
         prompt_history.append(observation_str)
+        messages.append({"role": "user", "content": observation_str})
+
+    log(f"📦 合计发送 {totals['bytes']} 字节，prompt tokens {totals['prompt_tokens']}，"
+        f"命中缓存 {totals['cached_tokens']} ({_ratio(totals['cached_tokens'], totals['prompt_tokens'])})")
+    return dict(totals, answer=final_answer, rounds=rounds)
+
+
+def _report_turn(client: OpenAICompatibleClient, totals: dict, log=print) -> None:
+    usage = client.last_usage
+    totals["bytes"] += client.last_request_bytes
+    totals["prompt_tokens"] += usage.get("prompt_tokens", 0)
+    totals["cached_tokens"] += usage.get("cached_tokens", 0)
+    if usage:
+        report = (f"📦 本轮发送 {client.last_request_bytes} 字节，prompt tokens {usage['prompt_tokens']}，"
+                  f"命中缓存 {usage['cached_tokens']} ({_ratio(usage['cached_tokens'], usage['prompt_tokens'])})")
+    else:
+        report = f"📦 本轮发送 {client.last_request_bytes} 字节，服务端未返回用量"
+    if client.last_aborted:
+        report += "，已在完整 Action 处提前结束生成"
+    log(report)
+
+
+def run_batch(client: OpenAICompatibleClient,
+              input_path: str,
+              output_path: str,
+              concurrency: int = 8,
+              **agent_kwargs) -> dict:
+    """
+    并发运行一批互不相关的旅行请求
+
+    输入为 JSONL，每行形如 {"id": "...", "prompt": "..."}，缺少 id 时以行号代替；
+    每个请求完成后立即追加写入输出 JSONL。输出文件中已成功的 id 会被跳过，中断后重新运行即可续跑，
+    失败的请求会被重新执行；中断时只写了一半的最后一行会被忽略。输入中重复的 id 只运行第一次出现的请求。
+
+    Returns:
+        dict: 本次运行的统计（完成数、失败数、耗时、吞吐量与轮数分布）
+    """
+    done_ids = set()
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 上次运行中断时写了一半的行
+                    continue
+                if record.get("status") == "ok":
+                    done_ids.add(str(record.get("id")))
+        # 最后一行没有换行时先补上，避免新记录与之粘连
+        with open(output_path, "rb+") as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    pending = []
+    seen_ids = set()
+    with open(input_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                request = json.loads(line)
+                request_id = str(request.get("id", line_no))
+                if request_id in seen_ids:
+                    print(f"⚠️ 第 {line_no} 行的 id {request_id} 重复，已跳过")
+                    continue
+                seen_ids.add(request_id)
+                if request_id not in done_ids:
+                    pending.append((request_id, request["prompt"]))
+    print(f"📋 共 {len(pending) + len(done_ids)} 个请求，已完成 {len(done_ids)} 个，本次运行 {len(pending)} 个，并发 {concurrency}")
+
+    def _run_one(request_id: str, prompt: str) -> dict:
+        started = time.perf_counter()
+        try:
+            result = run_agent(client, prompt, quiet=True, **agent_kwargs)
+            status = "ok" if result["answer"] is not None else "failed"
+            record = {"id": request_id, "status": status, **result}
+        except Exception as e:
+            record = {"id": request_id, "status": "failed", "error": str(e), "rounds": 0}
+        record["latency"] = round(time.perf_counter() - started, 3)
+        return record
+
+    started = time.perf_counter()
+    rounds = []
+    failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="agent") as pool, \
+            open(output_path, "a", encoding="utf-8") as out:
+        futures = [pool.submit(_run_one, request_id, prompt) for request_id, prompt in pending]
+        for n, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            rounds.append(record["rounds"])
+            failed += record["status"] != "ok"
+            if n % 50 == 0 or n == len(futures):
+                elapsed = time.perf_counter() - started
+                print(f"⏱️ {n}/{len(futures)} 完成，失败 {failed}，{n / elapsed:.2f} 请求/秒")
+
+    elapsed = time.perf_counter() - started
+    rounds.sort()
+    summary = {
+        "completed": len(rounds) - failed,
+        "failed": failed,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(rounds) / elapsed, 3) if elapsed else 0.0,
+        "rounds_mean": round(sum(rounds) / len(rounds), 2) if rounds else 0.0,
+        "rounds_p50": rounds[len(rounds) // 2] if rounds else 0,
+        "rounds_max": rounds[-1] if rounds else 0,
+        "rounds_histogram": {r: rounds.count(r) for r in sorted(set(rounds))},
+    }
+    print(f"✅ 批量运行结束: {summary}")
+    return summary
+
+
+def _ratio(part: int, whole: int) -> str:
+    return f"{part / whole:.0%}" if whole else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ReAct 旅行助手")
+    parser.add_argument("--mode", choices=["messages", "joined"], default="messages",
+                        help="messages: 多轮消息（可命中前缀缓存）; joined: 每轮拼接全部历史")
+    parser.add_argument("--no-stream", action="store_true", help="关闭流式生成与 Action 处的提前结束")
+    parser.add_argument("--batch", help="批量运行：输入 JSONL 文件，每行 {\"id\": ..., \"prompt\": ...}")
+    parser.add_argument("--output", default="quickstart_results.jsonl", help="批量运行的结果 JSONL 文件，可续跑")
+    parser.add_argument("--concurrency", type=int, default=8, help="批量运行的并发数")
+    args = parser.parse_args()
+
+    client = OpenAICompatibleClient(
+        model="deepseek-chat",
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_API_BASE_URL"),
+        quiet=bool(args.batch)
+    )
+
+    if args.batch:
+        run_batch(client, args.batch, args.output, concurrency=args.concurrency,
+                  mode=args.mode, stream=not args.no_stream)
+    else:
+        user_prompt = "帮我查询今天广州的天气，根据今天的天气推荐几个合适的旅游景点，输出要详细"
+        run_agent(client, user_prompt, mode=args.mode, stream=not args.no_stream)
+    print(f"🗂️ 工具缓存统计: {tool_cache_stats()}")
 
 
-if __name__ == "__main__": main()
\ No newline at end of file
+if __name__ == "__main__": main()
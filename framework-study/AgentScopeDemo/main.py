@@ -7,9 +7,11 @@
 import asyncio
 import os
 import random
+import sys
 from typing import List, Dict, Optional, Any, Literal
 from collections import Counter
 from pydantic import BaseModel, Field
+import httpx
 
 import agentscope
 from agentscope.agent import ReActAgent, AgentBase
@@ -18,6 +20,11 @@ from agentscope.pipeline import MsgHub, sequential_pipeline, fanout_pipeline
 from agentscope.message import Msg
 from agentscope.formatter import OpenAIChatFormatter
 
+# 复用手写范式中的共享限流器，所有玩家共用同一份 RPM/TPM 配额
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ConstructionOfClassicAgentParadigms"))
+from Cassette import get_shared_cassette
+from RateLimiter import get_shared_limiter
+
 # ==========================================
 # 1. 游戏角色定义 (from game_roles.py)
 # ==========================================
@@ -595,15 +602,26 @@ class ThreeKingdomsWerewolfGame:
         if not base_url:
             raise ValueError("Environment variable OPENAI_API_BASE_URL is not set.")
 
+        client_args = {"base_url": base_url}
+        # 配置了 LLM_RPM / LLM_TPM 时，所有玩家的请求经同一个限流器排队，避免触发服务商的 429
+        # 配置了 LLM_CASSETTE 时录制或回放整局对话，便于离线复现与基准测试
+        http_args = {}
+        limiter = get_shared_limiter()
+        if limiter is not None:
+            http_args["event_hooks"] = limiter.async_httpx_event_hooks(label=name)
+        cassette = get_shared_cassette()
+        if cassette is not None:
+            http_args["transport"] = cassette.async_transport()
+        if http_args:
+            client_args["http_client"] = httpx.AsyncClient(**http_args)
+
         agent = ReActAgent(
             name=name,
             sys_prompt=ChinesePrompts.get_role_prompt(role, character),
             model=OpenAIChatModel(
                 model_name=model_name,
                 api_key=api_key,
-                client_args={
-                    "base_url": base_url
-                },
+                client_args=client_args,
             ),
             formatter=OpenAIChatFormatter(),
         )
@@ -1,5 +1,7 @@
 import asyncio
 import os
+import sys
+import httpx
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.conditions import TextMentionTermination
@@ -10,8 +12,24 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# 复用手写范式中的共享限流器，所有智能体共用同一份 RPM/TPM 配额
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ConstructionOfClassicAgentParadigms"))
+from Cassette import get_shared_cassette
+from RateLimiter import get_shared_limiter
+
 def create_openai_model_client():
     """创建配置 OPEN AI 客户端"""
+    # 配置了 LLM_RPM / LLM_TPM 时，请求经共享限流器排队；配置了 LLM_CASSETTE 时录制或回放请求
+    http_args = {}
+    limiter = get_shared_limiter()
+    if limiter is not None:
+        http_args["event_hooks"] = limiter.async_httpx_event_hooks()
+    cassette = get_shared_cassette()
+    if cassette is not None:
+        http_args["transport"] = cassette.async_transport()
+    extra_args = {}
+    if http_args:
+        extra_args["http_client"] = httpx.AsyncClient(**http_args)
     return OpenAIChatCompletionClient(
         model="deepseek-ai/DeepSeek-V3.2",
         api_key=os.getenv("OPENAI_API_KEY"),
@@ -24,7 +42,8 @@ def create_openai_model_client():
             "json_output": True,
             "family": "deepseek",
             "structured_output": True,
-        }
+        },
+        **extra_args
     )
 
 
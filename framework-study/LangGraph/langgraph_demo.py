@@ -2,6 +2,7 @@ import os
 import sys
 from typing import Annotated, Literal, TypedDict, Union
 
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, BaseMessage, AIMessage, ToolMessage
@@ -10,6 +11,10 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
+# 复用手写范式中的录制/回放磁带，配置 LLM_CASSETTE 后可离线复现整个图的执行
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ConstructionOfClassicAgentParadigms"))
+from Cassette import get_shared_cassette
+
 # 尝试加载环境变量
 # 优先加载当前目录的 .env，如果没有，尝试加载 AutoGen 目录下的 .env (假设那里配置好了)
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -60,12 +65,19 @@ class AgentState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
 
 # 初始化模型
+cassette = get_shared_cassette()
+cassette_args = {}
+if cassette is not None:
+    cassette_args["http_client"] = httpx.Client(transport=cassette.transport())
+    cassette_args["http_async_client"] = httpx.AsyncClient(transport=cassette.async_transport())
+
 llm = ChatOpenAI(
     model=MODEL_NAME,
     openai_api_base=BASE_URL,
     openai_api_key=API_KEY,
     temperature=0,
-    streaming=True
+    streaming=True,
+    **cassette_args
 )
 
 # 绑定工具